@@ -0,0 +1,70 @@
+import statistics, time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+
+from domain.models import Restaurant, AppUser
+from services.menu_service import MenuService
+from services.order_service import OrderService
+
+class Rollback(Exception):
+    pass
+
+class Command(BaseCommand):
+    help = 'Places orders through OrderService and reports the SQL statements and latency per order. Rolled back unless --keep'
+
+    def add_arguments(self, parser):
+        parser.add_argument('restaurant_id', type = int)
+        parser.add_argument('appuser_id', type = int)
+        parser.add_argument('--orders', type = int, default = 100)
+        parser.add_argument('--items', type = int, default = 3, help = 'Line items per order')
+        parser.add_argument('--keep', action = 'store_true', help = 'Commit the orders instead of rolling them back')
+
+    def handle(self, *args, **options):
+        for name in ('orders', 'items'):
+            if options[name] < 1:
+                raise CommandError(f'--{name} must be at least 1')
+
+        restaurant = Restaurant.objects.filter(pk = options['restaurant_id']).first()
+        if restaurant == None:
+            raise CommandError(f'Restaurant {options["restaurant_id"]} does not exist')
+        if not AppUser.objects.filter(pk = options['appuser_id']).exists():
+            raise CommandError(f'App user {options["appuser_id"]} does not exist')
+
+        menu_item_ids = sorted(MenuService().get_price_index(restaurant.id)['items'])[:options['items']]
+        if not menu_item_ids:
+            raise CommandError(f'Restaurant {restaurant.id} has no active menu items')
+
+        service = OrderService()
+        statements = []
+        latencies = []
+
+        try:
+            with transaction.atomic():
+                for i in range(options['orders']):
+                    order = {
+                        'restaurant': restaurant,
+                        'note': f'bench {i}',
+                        'line_items': [{'menu_item_id': id, 'quantity': 1} for id in menu_item_ids],
+                        'extras': []
+                    }
+                    with CaptureQueriesContext(connection) as queries:
+                        started = time.perf_counter()
+                        if not service.validate(**order):
+                            raise CommandError('The generated order did not validate')
+                        service.create(options['appuser_id'], **order)
+                        latencies.append(time.perf_counter() - started)
+                    statements.append(len(queries))
+                if not options['keep']:
+                    raise Rollback()
+        except Rollback:
+            pass
+
+        latencies.sort()
+        self.stdout.write(f'orders: {len(latencies)}, line items per order: {len(menu_item_ids)}')
+        self.stdout.write(f'statements per order: mean {statistics.mean(statements):.2f}, max {max(statements)}')
+        self.stdout.write(f'latency: mean {statistics.mean(latencies) * 1000:.2f}ms, '
+                          f'p50 {latencies[len(latencies) // 2] * 1000:.2f}ms, '
+                          f'p95 {latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))] * 1000:.2f}ms')
+        self.stdout.write(self.style.SUCCESS('Rolled back' if not options['keep'] else 'Orders kept'))
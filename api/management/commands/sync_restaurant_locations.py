@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+
+from services.restaurants import RestaurantsService
+
+class Command(BaseCommand):
+    help = 'Fills the geography column of restaurants saved before it existed'
+
+    def handle(self, *args, **options):
+        updated = RestaurantsService().sync_locations()
+        self.stdout.write(self.style.SUCCESS(f'Updated the location of {updated} restaurants'))
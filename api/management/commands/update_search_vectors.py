@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+
+from services.restaurants import RestaurantsService
+
+class Command(BaseCommand):
+    help = 'Recomputes the full-text search vector of every restaurant'
+
+    def handle(self, *args, **options):
+        updated = RestaurantsService().update_search_vectors()
+        self.stdout.write(self.style.SUCCESS(f'Updated the search vectors of {updated} restaurants'))
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+
+from services.warmup_service import WarmupService
+
+class Command(BaseCommand):
+    help = 'Rebuilds prepop and the menu, option, restaurant and permission caches of the busiest restaurants'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--top', type = int, default = 100, help = 'Number of restaurants to warm, by orders over --days')
+        parser.add_argument('--days', type = int, default = 7)
+        parser.add_argument('--workers', type = int, default = 4)
+        parser.add_argument('--batch-size', type = int, default = 20)
+
+    def handle(self, *args, **options):
+        service = WarmupService(options['workers'], options['batch_size'])
+
+        def progress(done, total, restaurant, timings):
+            spent = sum(timings.values())
+            self.stdout.write(f'[{done}/{total}] {restaurant["slug"]} {spent * 1000:.0f}ms')
+
+        totals = service.warm(options['top'], options['days'], progress)
+
+        for name, seconds in totals.items():
+            self.stdout.write(f'{name}: {seconds:.3f}s')
+        self.stdout.write(self.style.SUCCESS('Caches warmed'))
@@ -2,13 +2,15 @@ from rest_framework import permissions
 
 from services.appuser_service import AppUserService
 from services.order_service import OrderService
+from services.user_service import UserService
 
 class Customer(permissions.BasePermission):
     def __init__(self):
         self.__appuser_service = AppUserService()
+        self.__user_service = UserService()
         
     def has_permission(self, request, view):
-        if request.user and request.user.groups.filter(name='Customer'):
+        if request.user and request.user.is_authenticated and self.__user_service.in_group(request.user.id, 'Customer'):
             appuser_id = self.__appuser_service.get_appuser_id_by_user_id(request.user.id)
             if not appuser_id:
                 return False
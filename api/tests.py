@@ -1,3 +1,230 @@
-from django.test import TestCase
+import datetime
 
-# Create your tests here.
+from unittest import mock, skipUnless
+
+from django.utils import timezone
+
+from django.contrib.auth.models import User, Group
+from django.db import DatabaseError
+from django.conf import settings
+from django.test import TestCase, override_settings
+from rest_framework.test import APIRequestFactory
+
+from domain.models import AppUser, Restaurant, RestaurantOperatingHours, Order, IdempotencyKey, OptionCategory
+from domain.constants import ORDER_RESTAURANT_MISMATCH_MSG
+from api.views import GetRestaurants
+from services.restaurants import RestaurantsService
+from services.order_service import OrderService
+from services.option_category_service import OptionCategoryService
+from services.user_service import UserService
+from services.appuser_service import AppUserService
+from services.geo_index import RestaurantsGeoIndex
+from services.idempotency_service import IdempotencyService, STARTED, IN_PROGRESS, MISMATCH
+from services.cache.restaurants_cache import RestaurantsCache
+from services.cache.nearby_cache import NearbyCache
+from services.cache.tags import restaurants_tag
+
+def create_restaurant(appuser, name, **kwargs):
+    fields = {
+        'appuser': appuser,
+        'name': name,
+        'cuisine': 'Fast food',
+        'address_line1': '1 Main Road',
+        'suburb': 'Avondale',
+        'city': 'Harare',
+        'banner_url': 'https://example.com/banner.png',
+        'phone': '0770000000',
+        'latitude': -17.8,
+        'longitude': 31.05,
+        'active': True
+    }
+    fields.update(kwargs)
+    restaurant = Restaurant.objects.create(**fields)
+    for day in range(7):
+        RestaurantOperatingHours.objects.create(restaurant = restaurant, day = day, opens = datetime.time(8), closes = datetime.time(22))
+    return restaurant
+
+def create_appuser(username = 'owner', cellphone = '0771111111'):
+    user = User.objects.create_user(username, f'{username}@example.com', 'password')
+    return AppUser.objects.create(user = user, cellphone = cellphone)
+
+class FullTextSearchTests(TestCase):
+    def test_keyset_pages_through_tied_ranks(self):
+        appuser = create_appuser()
+        ids = [create_restaurant(appuser, f'Burger {word}').id for word in
+               ('alpha', 'bravo', 'charlie', 'delta', 'echo', 'foxtrot', 'golf', 'hotel', 'india', 'juliet', 'kilo', 'lima')]
+        service = RestaurantsService()
+
+        seen = []
+        ranks = set()
+        cursor = ''
+        for _ in range(len(ids)):
+            page = service.__full_text_search__('burger', 1, 10, cursor)
+            seen += [restaurant.id for restaurant in page.data]
+            ranks |= set(restaurant.rank for restaurant in page.data)
+            cursor = page.next_cursor
+            if cursor == None:
+                break
+
+        self.assertEqual(len(ranks), 1)
+        self.assertEqual(seen, sorted(ids, reverse = True))
+
+    def test_matches_the_last_word_as_a_prefix(self):
+        appuser = create_appuser()
+        burger = create_restaurant(appuser, 'Burger Palace')
+        create_restaurant(appuser, 'Chicken Inn')
+
+        for query in ('burg', 'burger pal', 'Burger Palace'):
+            page = RestaurantsService().__full_text_search__(query, 1, 10)
+            self.assertEqual([restaurant.id for restaurant in page.data], [burger.id], query)
+
+        page = RestaurantsService().__full_text_search__('pal burger', 1, 10)
+        self.assertEqual(list(page.data), [])
+
+class OrderServiceTests(TestCase):
+    def test_update_rejects_another_restaurant(self):
+        appuser = create_appuser()
+        restaurant = create_restaurant(appuser, 'Burger Palace')
+        other = create_restaurant(appuser, 'Chicken Inn')
+        order = Order.objects.create(restaurant = restaurant, appuser = appuser, note = 'old')
+
+        updated, msg = OrderService().update(order.id, restaurant = other, note = 'new', line_items = [{'menu_item_id': 1, 'quantity': 1}])
+
+        self.assertFalse(updated)
+        self.assertEqual(msg, ORDER_RESTAURANT_MISMATCH_MSG)
+        self.assertEqual(Order.objects.get(pk = order.id).note, 'old')
+
+class RestaurantsGeoIndexTests(TestCase):
+    def test_applies_the_changes_of_other_processes(self):
+        appuser = create_appuser()
+        first = create_restaurant(appuser, 'Burger Palace')
+        geo_index = RestaurantsGeoIndex(0.05, 900)
+        self.assertEqual(set(geo_index.get().entries), {first.id})
+
+        # saved by another process: this one only learns about it through the changes and the shared generation
+        second = create_restaurant(appuser, 'Chicken Inn', latitude = -17.81)
+        Restaurant.objects.filter(pk = first.id).update(active = False)
+        self.assertEqual(set(geo_index.get().entries), {first.id})
+
+        for restaurant in (first, second):
+            geo_index.changed(restaurant.id)
+        RestaurantsCache().bump(restaurants_tag())
+
+        with mock.patch.object(geo_index, '__build__') as build:
+            self.assertEqual(set(geo_index.get().entries), {second.id})
+            build.assert_not_called()
+        self.assertEqual(geo_index.get().within(-17.81, 31.05, 100, day = 0), [(0.0, second.id)])
+
+class IdempotencyServiceTests(TestCase):
+    def test_takes_over_an_abandoned_reservation(self):
+        appuser = create_appuser()
+        service = IdempotencyService()
+        fingerprint = service.fingerprint('order:create', {'note': 'x'})
+
+        self.assertEqual(service.__begin_from_db__(appuser.id, 'key', 'order:create', fingerprint, reserve = True), (STARTED, None))
+        self.assertEqual(service.__begin_from_db__(appuser.id, 'key', 'order:create', fingerprint, reserve = True), (IN_PROGRESS, None))
+
+        # the request holding the key died without completing or releasing it
+        IdempotencyKey.objects.filter(key = 'key').update(created_on = timezone.now() - datetime.timedelta(minutes = 5))
+        self.assertEqual(service.__begin_from_db__(appuser.id, 'key', 'order:create', 'other', reserve = True), (MISMATCH, None))
+        self.assertEqual(service.__begin_from_db__(appuser.id, 'key', 'order:create', fingerprint, reserve = True), (STARTED, None))
+        self.assertEqual(service.__begin_from_db__(appuser.id, 'key', 'order:create', fingerprint, reserve = True), (IN_PROGRESS, None))
+
+class GetRestaurantsTests(TestCase):
+    def test_repeated_searches_are_served_from_the_cache(self):
+        create_restaurant(create_appuser(), 'Burger Palace')
+        # bumps only run on commit, start from a generation no earlier run cached under
+        RestaurantsCache().bump(restaurants_tag())
+        view = GetRestaurants.as_view()
+
+        responses = [view(APIRequestFactory().get('/api/restaurants/search/', {'q': 'burger'})) for _ in range(2)]
+
+        for response in responses:
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual([restaurant['name'] for restaurant in response.data['data']], ['Burger Palace'])
+        self.assertEqual(responses[0].data, responses[1].data)
+
+class RestaurantLoadingTests(TestCase):
+    def test_deferred_and_raw_restaurants_load(self):
+        restaurant = create_restaurant(create_appuser(), 'Burger Palace')
+
+        deferred = Restaurant.objects.only('name').get(pk = restaurant.id)
+        self.assertEqual(deferred.latitude, Restaurant.objects.get(pk = restaurant.id).latitude)
+        raw = list(Restaurant.objects.raw('SELECT id, name FROM restaurants WHERE id = %s', [restaurant.id]))
+        self.assertEqual([r.name for r in raw], ['Burger Palace'])
+
+class OptionCategoryServiceTests(TestCase):
+    def test_failed_admin_checks_are_logged_and_not_cached(self):
+        appuser = create_appuser()
+        restaurant = create_restaurant(appuser, 'Burger Palace')
+        category = OptionCategory.objects.create(restaurant = restaurant, heading = 'Sauces')
+        service = OptionCategoryService()
+        service.cache.delete(f'is_appuser_admin/?appuser_id={appuser.id}&id={category.id}')
+
+        with mock.patch.object(OptionCategory.objects, 'filter', side_effect = DatabaseError('down')), \
+             self.assertLogs('services.option_category_service', 'ERROR'):
+            self.assertFalse(service.is_appuser_admin(appuser.id, category.id))
+
+        self.assertTrue(service.is_appuser_admin(appuser.id, category.id))
+
+class UserServiceTests(TestCase):
+    def test_group_names_are_cached_until_cleared(self):
+        user = create_appuser().user
+        user.groups.add(Group.objects.create(name = 'Customer'))
+        service = UserService()
+        service.clear_groups(user.id)
+
+        with self.assertNumQueries(1):
+            self.assertTrue(service.in_group(user.id, 'Customer'))
+            self.assertFalse(service.in_group(user.id, 'place_admin'))
+
+        user.groups.clear()
+        service.clear_groups(user.id)
+        with self.assertNumQueries(1):
+            self.assertFalse(service.in_group(user.id, 'Customer'))
+            self.assertFalse(service.in_group(user.id, 'Customer'))
+
+class GetWithinRadiusTests(TestCase):
+    def setUp(self):
+        appuser = create_appuser()
+        self.names = [f'Restaurant {i:02}' for i in range(25)]
+        for i, name in enumerate(self.names):
+            create_restaurant(appuser, name, latitude = -17.795 + i * 0.001, longitude = 31.055)
+        NearbyCache(0.01, 0.25).bump_location(-17.795, 31.055)
+
+    def nearest(self, size):
+        '''
+            Walks every page of get_within_radius from the center of a location cache cell
+        '''
+        service = RestaurantsService()
+        names = []
+        cursor = None
+        with mock.patch('services.restaurants.restaurants_geo_index', RestaurantsGeoIndex(0.05, 900)):
+            while True:
+                page = service.get_within_radius(-17.795, 31.055, size, cursor)
+                names += [row['name'] if isinstance(row, dict) else row.name for row in page.data]
+                cursor = page.next_cursor
+                if not cursor:
+                    return names
+
+    @override_settings(GEO_CACHE_CELL_SIZE = 0.01, GEO_CACHE_TILE_SIZE = 0.25, GEO_CACHE_CELL_LIMIT = 12)
+    def test_pages_past_the_cached_nearest_come_from_the_index(self):
+        self.assertEqual(self.nearest(10), self.names)
+        self.assertEqual(self.nearest(20), self.names)
+
+    @skipUnless(settings.POSTGIS_ENABLED, 'needs PostGIS')
+    @override_settings(GEO_CACHE_CELL_SIZE = 0, GEO_INDEX_ENABLED = False)
+    def test_knn_query(self):
+        self.assertEqual(self.nearest(10), self.names)
+
+    @skipUnless(settings.POSTGIS_ENABLED, 'needs PostGIS')
+    @override_settings(GEO_CACHE_CELL_SIZE = 0.01, GEO_CACHE_TILE_SIZE = 0.25, GEO_CACHE_CELL_LIMIT = 12, GEO_INDEX_ENABLED = False)
+    def test_cells_cache_the_nearest_from_a_knn_query(self):
+        self.assertEqual(self.nearest(10), self.names)
+        self.assertEqual(self.nearest(20), self.names)
+
+class AppUserServiceTests(TestCase):
+    def test_failed_creates_are_logged(self):
+        with mock.patch.object(AppUser.objects, 'create', side_effect = DatabaseError('down')), \
+             self.assertLogs('services.appuser_service', 'ERROR'):
+            self.assertIsNone(AppUserService().create(cellphone = '0771111111'))
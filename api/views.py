@@ -1,6 +1,9 @@
+from django.http import HttpResponse
 from django.views.decorators.cache import cache_page
 from django.conf import settings
+from django.utils.cache import get_conditional_response
 from django.utils.decorators import method_decorator
+from django.utils.http import quote_etag
 from django.views.decorators.csrf import csrf_protect, ensure_csrf_cookie
 from rest_framework import status
 from rest_framework import permissions
@@ -8,9 +11,14 @@ from rest_framework.response import Response
 from rest_framework.generics import ListAPIView, CreateAPIView, RetrieveAPIView, UpdateAPIView
 from services.order_service import OrderService
 from services.menu_service import MenuService
-from services.restaurants import RestaurantsService
+from services.restaurants import RestaurantsService, SEARCH_MODE_FULL_TEXT
 from services.registration_service import RegistrationService
 from services.chat_service import ChatService
+from services.cache.base.metrics import cache_metrics
+from services.cache.base.cache_base import refresh_errors
+from services.cache.validators import conditional, query_params
+from services.cache.tags import restaurant_tag, restaurants_tag
+from services.idempotency_service import idempotent
 from domain.serializers import *
 from domain.models import Option, OptionCategory
 from .permissions import Customer, CanChangeOrder
@@ -40,6 +48,13 @@ class Register(CreateAPIView):
         response_serializer = AppUserResponseSerializer(app_user)
         return OK(response_serializer.data)
 
+def __restaurant_tags__(request, restaurant, *args, **kwargs):
+    restaurant_id = RestaurantsService().get_id_by_slug(restaurant)
+    return None if restaurant_id == None else (restaurant_tag(restaurant_id),)
+
+def __restaurants_tags__(request, *args, **kwargs):
+    return (restaurants_tag(),)
+
 class GetMenu(ListAPIView):
     '''
         Get a restaurant's menu
@@ -49,13 +64,17 @@ class GetMenu(ListAPIView):
     def __init__(self):
         self._menu = MenuService()
 
-    decorators = [cache_page(settings.ONE_DAY), ensure_csrf_cookie]
-
-    @method_decorator(cache_page(settings.ONE_DAY))
     def get(self, request, name):
-        menu = self._menu.get_menu(name)
-        serializer = RestaurantCategoryResponseSerializer(menu, many = True)
-        return Response(serializer.data)
+        menu = self._menu.get_menu_document(name)
+        etag = quote_etag(menu.etag)
+
+        not_modified = get_conditional_response(request, etag = etag)
+        if not_modified != None:
+            return not_modified
+
+        response = HttpResponse(menu.body, content_type = 'application/json')
+        response['ETag'] = etag
+        return response
 
     def get_queryset(self):
         return self._menu.get_queryset()
@@ -69,6 +88,7 @@ class CreateOrder(CreateAPIView):
         self._order_service = OrderService()
 
     #@method_decorator(csrf_protect)
+    @idempotent('order:create')
     def post(self, request):
         serializer = OrderCreateSerializer(data = request.data)
         if not serializer.is_valid():
@@ -103,6 +123,7 @@ class UpdateOrder(UpdateAPIView):
         self._order_service = OrderService()
     
     #@method_decorator(cache_page(60))
+    @idempotent('order:update')
     def put(self, request, order_id):     
         serializer = OrderCreateSerializer(data = request.data)
         if not serializer.is_valid():
@@ -131,12 +152,14 @@ class GetRestaurants(ListAPIView):
     def __init__(self):
         self._restaurants = RestaurantsService()
 
-    @method_decorator(cache_page(settings.ONE_DAY))
+    @conditional(__restaurants_tags__, query_params('q', 'page', 'size', 'mode', 'cursor'))
     def get(self, request):
         q = request.query_params.get('q', None)
         page = request.query_params.get('page', 1)
         size = request.query_params.get('size', 10)
-        restaurants = self._restaurants.search(q, page, size)
+        mode = request.query_params.get('mode', SEARCH_MODE_FULL_TEXT)
+        cursor = request.query_params.get('cursor', None)
+        restaurants = self._restaurants.search(q, page, size, mode, cursor)
 
         resp = restaurants.serialize_data(RestaurantsListResponseSerializer)
 
@@ -151,7 +174,7 @@ class GetWithinRadius(ListAPIView):
     def __init__(self, **kwargs):
         self._restaurants = RestaurantsService()
 
-    @method_decorator(cache_page(settings.ONE_DAY))
+    @conditional(__restaurants_tags__, query_params('lat', 'lng', 'size', 'cursor'), daily = True)
     def get(self, request):
         lat = request.query_params.get('lat', None)
         lng = request.query_params.get('lng', None)
@@ -161,11 +184,14 @@ class GetWithinRadius(ListAPIView):
                 'Invalid request': 'Latitude and longitude are required as query parameters.'
             })
 
-        restaurants = self._restaurants.get_within_radius(lat, lng)
+        size = request.query_params.get('size', 10)
+        cursor = request.query_params.get('cursor', None)
+
+        restaurants = self._restaurants.get_within_radius(lat, lng, size, cursor)
 
-        serializer = RestaurantsListResponseSerializer(restaurants, many = True)
+        resp = restaurants.serialize_data(NearbyRestaurantResponseSerializer)
 
-        return Response(serializer.data)
+        return Response(resp)
 
 class PrepopRestaurants(ListAPIView):
     '''
@@ -176,7 +202,6 @@ class PrepopRestaurants(ListAPIView):
     def __init__(self):
         self._restaurants = RestaurantsService()
     
-    @method_decorator(cache_page(settings.ONE_DAY))
     def get(self, request):
         query = request.query_params.get('q', None)
 
@@ -199,13 +224,29 @@ class GetMenuItemOptions(ListAPIView):
     def get_queryset(self):
         return self._menu.get_queryset()
     
-    #@method_decorator(cache_page(settings.ONE_DAY))
+    @conditional(__restaurant_tags__)
     def get(self, request, restaurant: str, menu_item: str):
         options = self._menu.get_options(restaurant, menu_item)
 
-        serializer = MenuItemOptionResponseSerializer(options, many = True)
+        return Response(options)
+
+class GetRestaurantOptions(ListAPIView):
+    '''
+        Get the options of every menu item of a restaurant in one call, instead of GetMenuItemOptions per item.
+    '''
+    permission_classes = (permissions.AllowAny, )
+
+    def __init__(self):
+        self._menu = MenuService()
+
+    def get_queryset(self):
+        return self._menu.get_queryset()
+
+    @conditional(__restaurant_tags__)
+    def get(self, request, restaurant: str):
+        options = self._menu.get_all_options(restaurant)
 
-        return Response(serializer.data)
+        return Response(options)
 
 class GetChatrooms(ListAPIView):
     permission_classes = (Customer,)
@@ -214,4 +255,17 @@ class GetChatrooms(ListAPIView):
 
     def get(self, request):
         chatrooms = self._chat_service.get_appuser_chatrooms(request.appuser_id)
-        return OK(chatrooms)
\ No newline at end of file
+        return OK(chatrooms)
+
+class CacheMetrics(RetrieveAPIView):
+    '''
+        Cache hit/miss/latency counters of the process serving the request, by cache prefix and key family,
+        and the most recent failed background refreshes of all processes
+    '''
+    permission_classes = (permissions.IsAdminUser,)
+
+    def get(self, request):
+        return OK({
+            'caches': cache_metrics.snapshot(),
+            'refresh_errors': refresh_errors()
+        })
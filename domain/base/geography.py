@@ -0,0 +1,36 @@
+from django.conf import settings
+from django.db import models
+
+SRID = 4326
+
+class GeographyPointField(models.Field):
+    '''
+        A WGS84 point stored as a PostGIS geography. Values are written as (longitude, latitude) tuples.
+        Databases without PostGIS (settings.POSTGIS_ENABLED = False) store the same EWKT as text.
+    '''
+    description = 'WGS84 geography point'
+
+    def db_type(self, connection):
+        if settings.POSTGIS_ENABLED:
+            return f'geography(Point, {SRID})'
+        return 'text'
+
+    def get_db_prep_value(self, value, connection, prepared = False):
+        if value == None or isinstance(value, str):
+            return value
+        longitude, latitude = value
+        return f'SRID={SRID};POINT({longitude} {latitude})'
+
+    def from_db_value(self, value, expression, connection):
+        return value
+
+class GeographyIndex(models.Index):
+    '''
+        GiST index for geography columns, falls back to a plain index when PostGIS is not available
+    '''
+    suffix = 'gix'
+
+    def create_sql(self, model, schema_editor, using = ''):
+        if settings.POSTGIS_ENABLED:
+            using = ' USING gist'
+        return super().create_sql(model, schema_editor, using = using)
@@ -0,0 +1,20 @@
+import re
+
+from django.contrib.postgres.search import SearchQuery
+
+TERM_PATTERN = re.compile(r'[^\W_]+')
+
+class PrefixSearchQuery(SearchQuery):
+    '''
+        Matches documents containing every word of the query, the last one as a prefix, so that
+        "burg" finds "Burger Palace" as it is typed. plainto_tsquery only matches whole words.
+    '''
+    def __init__(self, value, **kwargs):
+        terms = TERM_PATTERN.findall(value)
+        if terms:
+            terms[-1] += ':*'
+        super().__init__(' & '.join(terms), **kwargs)
+
+    def as_sql(self, compiler, connection):
+        sql, params = super().as_sql(compiler, connection)
+        return sql.replace('plainto_tsquery(', 'to_tsquery(', 1), params
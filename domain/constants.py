@@ -2,4 +2,6 @@ ORDER_ACCEPTED_STATUS = 'Accepted'
 ORDER_CANCELLED_STATUS = 'Cancelled'
 ORDER_CANCELLED_BY_CUSTOMER = 'Order was cancelled by customer'
 CANNOT_CHANGE_ORDER_MSG = 'Order has been accepted by merchant. Please contact our call center.'
-ORDER_STATUSES = (('Submitted', 'Submitted'), ('Cancelled', 'Cancelled'), ('Completed', 'Completed'), ('Accepted', 'Accepted'))
\ No newline at end of file
+ORDER_RESTAURANT_MISMATCH_MSG = 'An order cannot be moved to another restaurant'
+ORDER_STATUSES = (('Submitted', 'Submitted'), ('Cancelled', 'Cancelled'), ('Completed', 'Completed'), ('Accepted', 'Accepted'))
+SEARCH_CONFIG = 'english'
\ No newline at end of file
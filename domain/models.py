@@ -1,8 +1,12 @@
-from django.db import models
+from django.db import models, transaction
 from django.contrib.auth.models import User
+from django.contrib.postgres.fields import JSONField
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVector, SearchVectorField
 
 from .base.abstract import Place, OperatingHours, Category, MenuItem
-from .constants import ORDER_STATUSES
+from .base.geography import GeographyPointField, GeographyIndex
+from .constants import ORDER_STATUSES, SEARCH_CONFIG
 
 # Create your models here.
 class AppUser(models.Model):
@@ -32,10 +36,32 @@ class Restaurant(Place):
     appuser = models.ForeignKey(AppUser, on_delete = models.CASCADE, related_name = 'restaurants')
     cuisine = models.CharField(max_length = 150, db_index = True)
     capacity = models.IntegerField(default = 0, null = True, blank = True)
+    search_vector = SearchVectorField(null = True, editable = False)
+    location = GeographyPointField(null = True, editable = False)
     class Meta:
         db_table = 'restaurants'
         ordering = ('-id',)
         unique_together = ('name', 'appuser')
+        indexes = [
+            GinIndex(fields = ['search_vector'], name = 'restaurants_search_gin'),
+            GeographyIndex(fields = ['location'], name = 'restaurants_location_gix')
+        ]
+
+    def save(self, *args, **kwargs):
+        if self.latitude != None and self.longitude != None:
+            self.location = (self.longitude, self.latitude)
+        # one transaction, so the cache bumps queued on commit by post_save run after the search vector is written
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            Restaurant.objects.filter(pk = self.pk).update(search_vector = restaurant_search_vector())
+
+def restaurant_search_vector():
+    '''
+        The weighted document restaurants are searched on: name ranks above cuisine, which ranks above location
+    '''
+    return SearchVector('name', weight = 'A', config = SEARCH_CONFIG) + \
+           SearchVector('cuisine', weight = 'B', config = SEARCH_CONFIG) + \
+           SearchVector('suburb', 'city', weight = 'C', config = SEARCH_CONFIG)
 
 class LiqourOutlet(Place):
     '''
@@ -216,3 +242,19 @@ class ChatMessage(models.Model):
     class Meta:
         db_table = 'chat_messages'
         ordering = ('-sent',)
+
+class IdempotencyKey(models.Model):
+    '''
+        The stored response of a request sent with an Idempotency-Key header, replayed when the request is retried
+    '''
+    appuser = models.ForeignKey(AppUser, on_delete = models.CASCADE, related_name = 'idempotency_keys')
+    key = models.CharField(max_length = 255)
+    scope = models.CharField(max_length = 100)
+    fingerprint = models.CharField(max_length = 40)
+    status_code = models.IntegerField(null = True)
+    response = JSONField(null = True)
+    created_on = models.DateTimeField(auto_now_add = True, db_index = True)
+
+    class Meta:
+        db_table = 'idempotency_keys'
+        unique_together = ('appuser', 'key')
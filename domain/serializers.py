@@ -47,11 +47,13 @@ class OrderLineItemCreateSerializer(serializers.ModelSerializer):
     '''
         Order detail create serializer to serialize incoming order line_items on order creation
     '''
+    menu_item = serializers.IntegerField(source = 'menu_item_id')
     class Meta:
         model = OrderLineItem
         fields = ('menu_item', 'quantity')
 
 class OptionSerializer(serializers.ModelSerializer):
+    id = serializers.IntegerField()
     class Meta:
         model = Option
         fields = ('id',)
@@ -121,7 +123,7 @@ class RestaurantCreateSerializer(serializers.ModelSerializer):
 class RestaurantsListResponseSerializerAdmin(serializers.ModelSerializer):
     class Meta:
         model = Restaurant
-        exclude = ('appuser', 'last_updated', 'created_on', 'slug')
+        exclude = ('appuser', 'last_updated', 'created_on', 'slug', 'search_vector', 'location')
 
 class RestaurantsListResponseSerializer(serializers.ModelSerializer):
     '''
@@ -134,10 +136,29 @@ class RestaurantsListResponseSerializer(serializers.ModelSerializer):
         fields = ('name', 'slug', 'banner_url', 'cuisine', 'times', 'distance')
 
     def get_closing_time(self, obj):
+        closes = getattr(obj, 'closes', None)
+        if closes != None:
+            return closes
         return obj.operating_hours.all()[0].closes
 
     def get_distance(self, obj):
-        return obj.distance / 1000
+        distance = getattr(obj, 'distance', None)
+        return distance / 1000 if distance != None else None
+
+class NearbyRestaurantResponseSerializer(serializers.Serializer):
+    '''
+        Serializes nearby restaurants, which are either restaurant rows or cached dicts carrying closes and distance in meters
+    '''
+    name = serializers.CharField()
+    slug = serializers.CharField()
+    banner_url = serializers.CharField()
+    cuisine = serializers.CharField()
+    times = serializers.TimeField(source = 'closes')
+    distance = serializers.SerializerMethodField()
+
+    def get_distance(self, obj):
+        distance = obj['distance'] if isinstance(obj, dict) else obj.distance
+        return distance / 1000
 
 class RestaurantCategoryResponseSerializer(serializers.ModelSerializer):
     '''
@@ -196,6 +217,16 @@ class MenuItemOptionResponseSerializer(serializers.ModelSerializer):
         model = OptionCategory
         fields = ('heading', 'options', 'multi', 'mandatory', 'num_choose')
 
+class RestaurantOptionCategoryResponseSerializer(serializers.ModelSerializer):
+    '''
+        Option category response serializer for serializing every option category of a restaurant in one response
+    '''
+    options = OptionResponseSerializer(many = True)
+    multi = serializers.BooleanField(source = 'multiple_choice')
+    class Meta:
+        model = OptionCategory
+        fields = ('id', 'heading', 'options', 'multi', 'mandatory', 'num_choose')
+
 class MenuItemCreateSerializer(serializers.ModelSerializer):
     class Meta:
         model = MenuItem
@@ -211,4 +242,44 @@ class CategoryUpdateSerializer(serializers.ModelSerializer):
         model = Category
         fields = ('name',)
 
+class MenuImportOptionSerializer(serializers.Serializer):
+    name = serializers.CharField(max_length = 50)
+    price = serializers.DecimalField(max_digits = 10, decimal_places = 2, min_value = 0)
 
+class MenuImportOptionCategorySerializer(serializers.Serializer):
+    heading = serializers.CharField(max_length = 50)
+    mandatory = serializers.BooleanField(default = False)
+    multiple_choice = serializers.BooleanField(default = False)
+    num_choose = serializers.IntegerField(default = 1, min_value = 1)
+    options = MenuImportOptionSerializer(many = True, required = False)
+
+class MenuImportItemSerializer(serializers.Serializer):
+    name = serializers.CharField(max_length = 50)
+    price = serializers.DecimalField(max_digits = 6, decimal_places = 2, min_value = 0)
+    active = serializers.BooleanField(default = True)
+    option_categories = serializers.ListField(child = serializers.CharField(max_length = 50), required = False)
+
+class MenuImportCategorySerializer(serializers.Serializer):
+    name = serializers.CharField(max_length = 50)
+    items = MenuImportItemSerializer(many = True)
+
+class MenuImportSerializer(serializers.Serializer):
+    '''
+        Menu import serializer for validating bulk menu imports: categories with their items, and the option
+        categories the items refer to by heading
+    '''
+    categories = MenuImportCategorySerializer(many = True)
+    option_categories = MenuImportOptionCategorySerializer(many = True, required = False)
+
+    def validate(self, attrs):
+        names = [category['name'] for category in attrs.get('categories')]
+        if len(names) != len(set(names)):
+            raise serializers.ValidationError({
+                'categories': 'Category names must be unique.'
+            })
+        headings = [option_category['heading'] for option_category in attrs.get('option_categories', [])]
+        if len(headings) != len(set(headings)):
+            raise serializers.ValidationError({
+                'option_categories': 'Option category headings must be unique.'
+            })
+        return super().validate(attrs)
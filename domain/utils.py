@@ -1,3 +1,6 @@
+from functools import reduce
+from operator import or_
+from django.db.models import Q
 from django.utils.text import slugify
  
  
@@ -7,15 +10,36 @@ def get_unique_slug(model_instance, slugable_field_name, slug_field_name):
     model as string, slug field name (such as 'slug') of the model as string;
     returns a unique slug as string.
     """
-    slug = slugify(getattr(model_instance, slugable_field_name))
-    unique_slug = slug
-    extension = 1
-    ModelClass = model_instance.__class__
- 
-    while ModelClass._default_manager.filter(
-        **{slug_field_name: unique_slug}
-    ).exists():
-        unique_slug = '{}-{}'.format(slug, extension)
-        extension += 1
- 
-    return unique_slug
\ No newline at end of file
+    return get_unique_slugs([model_instance], slugable_field_name, slug_field_name)[0]
+
+
+def get_unique_slugs(model_instances, slugable_field_name, slug_field_name):
+    """
+    Batch version of get_unique_slug for instances of the same model. Every
+    slug that could collide is fetched with a single prefix query, then each
+    instance gets the first free one of slug, slug-1, slug-2, ... Slugs are
+    unique among the instances too. Returns the slugs in order; the instances
+    are not changed.
+    """
+    if not model_instances:
+        return []
+
+    ModelClass = model_instances[0].__class__
+    bases = [slugify(getattr(instance, slugable_field_name)) for instance in model_instances]
+
+    prefixes = reduce(or_, (Q(**{f'{slug_field_name}__startswith': base}) for base in set(bases)))
+    taken = set(ModelClass._default_manager.filter(prefixes).values_list(slug_field_name, flat = True))
+    next_extension = {}
+
+    slugs = []
+    for base in bases:
+        unique_slug = base
+        extension = next_extension.get(base, 1)
+        while unique_slug in taken:
+            unique_slug = '{}-{}'.format(base, extension)
+            extension += 1
+        next_extension[base] = extension
+        taken.add(unique_slug)
+        slugs.append(unique_slug)
+
+    return slugs
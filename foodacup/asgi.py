@@ -0,0 +1,19 @@
+"""
+ASGI entrypoint for foodacup, serving HTTP and the merchant websockets.
+
+Run it with daphne: daphne foodacup.asgi:application
+See https://channels.readthedocs.io/en/2.1.3/deploying.html
+"""
+
+import os
+
+import django
+from channels.routing import get_default_application
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "foodacup.settings")
+django.setup()
+
+application = get_default_application()
+
+from services.warmup_service import start_warmup
+start_warmup()
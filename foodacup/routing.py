@@ -1,5 +1,11 @@
-from channels.routing import ProtocolTypeRouter
+from channels.routing import ProtocolTypeRouter, URLRouter
+from django.conf.urls import url
+
+from merchants.consumers import OrdersConsumer
 
 application = ProtocolTypeRouter({
     # (http->django views is added by default)
-})
\ No newline at end of file
+    'websocket': URLRouter([
+        url(r'^ws/admin/orders/(?P<restaurant_id>\d+)/$', OrdersConsumer),
+    ]),
+})
@@ -41,7 +41,9 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     'corsheaders',
+    'channels',
     'rest_framework',
     'oauth2_provider',
     'merchants',
@@ -138,6 +140,22 @@ CACHES = {
     }
 }
 
+# Per process LRU in front of redis, see services/cache/base/local_cache.py
+CACHE_L1 = {
+    'ENABLED': True,
+    'MAX_SIZE': 2048,
+    'TTL': 5 #seconds
+}
+
+CHANNEL_LAYERS = {
+    'default': {
+        'BACKEND': 'channels_redis.core.RedisChannelLayer',
+        'CONFIG': {
+            'hosts': ['redis://:foobared@127.0.0.1:6379/2'],
+        },
+    },
+}
+
 ASGI_APPLICATION = 'foodacup.routing.application'
 WSGI_APPLICATION = 'foodacup.wsgi.application'
 
@@ -200,6 +218,14 @@ STATIC_URL = '/static/'
 ONE_DAY = 60 * 60 * 24
 ONE_HOUR = 60 * 60
 FIFTEEN_MINUTES = 60 * 15
+ENTITY_CACHE_TIMEOUT = 6 * ONE_HOUR #menus, options and restaurant cards, invalidated by generation on every write
+ENTITY_CACHE_STALE_AFTER = FIFTEEN_MINUTES #served while a background refresh runs, up to ENTITY_CACHE_TIMEOUT
+CACHE_REFRESH_WORKERS = 4
+IDEMPOTENCY_KEY_TIMEOUT = ONE_DAY #how long a response is replayed for the same Idempotency-Key
+IDEMPOTENCY_LOCK_TIMEOUT = 30 #how long a request holds its Idempotency-Key before a retry may run it again
+NEGATIVE_CACHE_TIMEOUT = 60 #how long a missing slug or id is remembered, cleared when it gets created
+CACHE_WARMUP_ON_START = variables.get('CACHE_WARMUP_ON_START', False) #warms from the wsgi/asgi entrypoints, see also the warm_caches command
+CACHE_WARMUP_TOP = 100
 PAGE_SIZE = 10
 PAGE_NUMBER = 1
 
@@ -213,6 +239,15 @@ GOOGLE_API_KEY = variables['GOOGLE_API_KEY']
 
 SEARCH_RADIUS = 25000 #meters
 
+POSTGIS_ENABLED = variables.get('POSTGIS_ENABLED', True)
+
+GEO_INDEX_ENABLED = variables.get('GEO_INDEX_ENABLED', not POSTGIS_ENABLED)
+GEO_INDEX_CELL_SIZE = 0.05 #degrees
+GEO_INDEX_MAX_AGE = FIFTEEN_MINUTES
+GEO_CACHE_CELL_SIZE = 0.01 #degrees, set to 0 to disable the location cache
+GEO_CACHE_TILE_SIZE = 0.25 #degrees
+GEO_CACHE_CELL_LIMIT = 200 #nearest restaurants cached per cell, pages past them are read from the database
+
 if not DEBUG:
     SECURE_CONTENT_TYPE_NOSNIFF = True
     #SECURE_SSL_REDIRECT = True
@@ -14,3 +14,6 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "foodacup.settings")
 
 application = get_wsgi_application()
+
+from services.warmup_service import start_warmup
+start_warmup()
@@ -0,0 +1,79 @@
+from urllib.parse import parse_qs
+
+from channels.db import database_sync_to_async
+from channels.generic.websocket import AsyncJsonWebsocketConsumer
+from django.utils import timezone
+from oauth2_provider.models import AccessToken
+from services.appuser_service import AppUserService
+from services.restaurants import RestaurantsService
+from services.user_service import UserService
+from services.order_feed_service import OrderFeedService, orders_group, ORDER_SNAPSHOT
+from utils.app_logger import get_logger
+
+logger = get_logger(__name__)
+
+class OrdersConsumer(AsyncJsonWebsocketConsumer):
+    '''
+        Streams a restaurant's orders to its admins instead of them polling GetOrders. Connect to
+        ws/admin/orders/<restaurant_id>/ with an OAuth2 access token as the token query parameter or a
+        bearer Authorization header. Today's pending orders are sent on connect, then every order that is
+        created, updated or cancelled as {event, order}
+    '''
+    async def connect(self):
+        self.group = None
+        restaurant_id = int(self.scope['url_route']['kwargs']['restaurant_id'])
+
+        allowed = await database_sync_to_async(self.__authorize__)(self.__token__(), restaurant_id)
+        if not allowed:
+            await self.close()
+            return
+
+        self.group = orders_group(restaurant_id)
+        await self.channel_layer.group_add(self.group, self.channel_name)
+        await self.accept()
+
+        pending = await database_sync_to_async(self.__pending_orders__)(restaurant_id)
+        await self.send_json({'event': ORDER_SNAPSHOT, 'orders': pending})
+
+    async def disconnect(self, code):
+        if self.group != None:
+            await self.channel_layer.group_discard(self.group, self.channel_name)
+
+    async def receive_json(self, content, **kwargs):
+        # the feed is one way
+        pass
+
+    async def order_event(self, message):
+        await self.send_json({'event': message['event'], 'order': message['order']})
+
+    def __token__(self):
+        query = parse_qs(self.scope.get('query_string', b'').decode())
+        if query.get('token'):
+            return query['token'][0]
+        for name, value in self.scope.get('headers', []):
+            if name == b'authorization' and value.lower().startswith(b'bearer '):
+                return value[7:].decode()
+        return None
+
+    def __authorize__(self, token, restaurant_id):
+        '''
+            Whether @token belongs to a place admin of restaurant @restaurant_id
+        '''
+        if not token:
+            return False
+
+        access_token = AccessToken.objects.select_related('user').filter(token = token, expires__gt = timezone.now()).first()
+        if access_token == None or access_token.user == None:
+            return False
+
+        if not UserService().in_group(access_token.user_id, 'place_admin'):
+            return False
+
+        appuser_id = AppUserService().get_appuser_id_by_user_id(access_token.user_id)
+        if not appuser_id:
+            return False
+
+        return RestaurantsService().check_admin(appuser_id, restaurant_id)
+
+    def __pending_orders__(self, restaurant_id):
+        return OrderFeedService().pending(restaurant_id)
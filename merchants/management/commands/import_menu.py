@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from domain.models import Restaurant
+from services.menu_import_service import MenuImportService, MenuImportError, FORMAT_CSV, FORMAT_JSON
+
+class Command(BaseCommand):
+    help = 'Imports a restaurant menu from a JSON or CSV file in one transaction'
+
+    def add_arguments(self, parser):
+        parser.add_argument('restaurant_id', type = int)
+        parser.add_argument('path')
+        parser.add_argument('--format', choices = (FORMAT_JSON, FORMAT_CSV), default = None, help = 'Defaults to the file extension')
+
+    def handle(self, *args, **options):
+        if not Restaurant.objects.filter(pk = options['restaurant_id']).exists():
+            raise CommandError(f'Restaurant {options["restaurant_id"]} does not exist')
+
+        format = options['format'] or (FORMAT_CSV if options['path'].lower().endswith('.csv') else FORMAT_JSON)
+        service = MenuImportService()
+
+        with open(options['path'], 'rb') as f:
+            content = f.read()
+
+        try:
+            created = service.import_menu(options['restaurant_id'], service.parse(content, format))
+        except MenuImportError as e:
+            raise CommandError(e.errors)
+
+        for name, count in created.items():
+            self.stdout.write(f'{name}: {count}')
+        self.stdout.write(self.style.SUCCESS('Menu imported'))
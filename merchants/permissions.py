@@ -1,5 +1,6 @@
 from rest_framework import permissions
 from services.appuser_service import AppUserService
+from services.user_service import UserService
 from services.restaurants import RestaurantsService
 from services.category_service import CategoryService
 from services.option_category_service import OptionCategoryService
@@ -9,9 +10,10 @@ from services.appuser_service import AppUserService
 class PlaceAdmin(permissions.BasePermission):
     def __init__(self):
         self._appuser_service = AppUserService()
+        self._user_service = UserService()
 
     def has_permission(self, request, view):
-        if request.user and request.user.groups.filter(name='place_admin'):
+        if request.user and request.user.is_authenticated and self._user_service.in_group(request.user.id, 'place_admin'):
             appuser_id = self._appuser_service.get_appuser_id_by_user_id(request.user.id)
             if not appuser_id:
                 return False
@@ -25,16 +27,21 @@ class RestaurantAdmin(permissions.BasePermission):
         self.__restaurants_service = RestaurantsService()
 
     def has_permission(self, request, view):
-        restaurant_id = view.kwargs.get('restaurant_id')
-
-        if restaurant_id == None:
-            restaurant_id = request.data.get('restaurant_id')
-            if restaurant_id == None:
-                return False
+        '''
+            The app user must administer every restaurant the request names: the url's and any the body
+            refers to, e.g. the restaurant a new category is added to. They are all checked in one batch
+        '''
+        data = request.data if isinstance(request.data, dict) else {}
+        named = [view.kwargs.get('restaurant_id'), data.get('restaurant_id'), data.get('restaurant')]
+        try:
+            restaurant_ids = set(int(restaurant_id) for restaurant_id in named if restaurant_id not in (None, ''))
+        except (TypeError, ValueError):
+            return False
 
-        is_admin = self.__restaurants_service.check_admin(request.appuser_id, restaurant_id)
+        if not restaurant_ids:
+            return False
 
-        return is_admin
+        return all(self.__restaurants_service.check_admin_many(request.appuser_id, restaurant_ids).values())
             
 class ChangeCategory(permissions.BasePermission):
     def __init__(self):
@@ -1,3 +1,133 @@
-from django.test import TestCase
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from channels.db import database_sync_to_async
+from channels.layers import get_channel_layer
+from channels.testing import WebsocketCommunicator
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+
+from api.tests import create_appuser, create_restaurant
+from domain.models import Order
+from foodacup.routing import application
+from merchants.consumers import OrdersConsumer
+from merchants.permissions import RestaurantAdmin
+from services.appuser_service import AppUserService
+from services.restaurants import RestaurantsService
+from services.cache.app_users_cache import AppUsersCache
+from services.order_feed_service import orders_group, order_message, ORDER_CREATED, ORDER_SNAPSHOT
+
+IN_MEMORY_CHANNEL_LAYERS = {
+    'default': {
+        'BACKEND': 'channels.layers.InMemoryChannelLayer'
+    }
+}
+
+PENDING_ORDER = {'id': 1, 'status': 'Submitted', 'total': '90.00', 'line_items': []}
+NEW_ORDER = {'id': 2, 'status': 'Submitted', 'total': '45.50', 'line_items': []}
+
+@override_settings(CHANNEL_LAYERS = IN_MEMORY_CHANNEL_LAYERS)
+@mock.patch.object(OrdersConsumer, '__pending_orders__', return_value = [PENDING_ORDER])
+class OrdersConsumerTests(SimpleTestCase):
+    def test_rejects_connections_without_admin_access(self, pending_orders):
+        async def run():
+            communicator = WebsocketCommunicator(application, '/ws/admin/orders/1/?token=nope')
+            connected, _ = await communicator.connect()
+            self.assertFalse(connected)
+
+        with mock.patch.object(OrdersConsumer, '__authorize__', return_value = False) as authorize:
+            async_to_sync(run)()
+            authorize.assert_called_once_with('nope', 1)
+
+    def test_sends_pending_orders_on_connect(self, pending_orders):
+        async def run():
+            communicator = WebsocketCommunicator(application, '/ws/admin/orders/1/?token=secret')
+            connected, _ = await communicator.connect()
+            self.assertTrue(connected)
+            self.assertEqual(await communicator.receive_json_from(), {'event': ORDER_SNAPSHOT, 'orders': [PENDING_ORDER]})
+            await communicator.disconnect()
+
+        with mock.patch.object(OrdersConsumer, '__authorize__', return_value = True):
+            async_to_sync(run)()
+
+    def test_pushes_orders_to_their_restaurant_only(self, pending_orders):
+        async def run():
+            restaurant = WebsocketCommunicator(application, '/ws/admin/orders/1/?token=secret')
+            other = WebsocketCommunicator(application, '/ws/admin/orders/2/?token=secret')
+            await restaurant.connect()
+            await other.connect()
+            await restaurant.receive_json_from()
+            await other.receive_json_from()
+
+            await get_channel_layer().group_send(orders_group(1), order_message(ORDER_CREATED, NEW_ORDER))
+
+            self.assertEqual(await restaurant.receive_json_from(), {'event': ORDER_CREATED, 'order': NEW_ORDER})
+            self.assertTrue(await other.receive_nothing())
+
+            await restaurant.disconnect()
+            await other.disconnect()
+
+        with mock.patch.object(OrdersConsumer, '__authorize__', return_value = True):
+            async_to_sync(run)()
+
+@override_settings(CHANNEL_LAYERS = IN_MEMORY_CHANNEL_LAYERS)
+class OrderFeedTests(TransactionTestCase):
+    '''
+        Orders are published once their transaction commits, which a TestCase never does
+    '''
+    def test_saved_orders_reach_their_restaurant_websocket(self):
+        appuser = create_appuser()
+        restaurant = create_restaurant(appuser, 'Burger Palace')
+
+        async def run():
+            communicator = WebsocketCommunicator(application, f'/ws/admin/orders/{restaurant.id}/?token=secret')
+            connected, _ = await communicator.connect()
+            self.assertTrue(connected)
+            self.assertEqual(await communicator.receive_json_from(), {'event': ORDER_SNAPSHOT, 'orders': []})
+
+            order = await database_sync_to_async(Order.objects.create)(restaurant = restaurant, appuser = appuser, total = '45.50')
+
+            message = await communicator.receive_json_from()
+            self.assertEqual(message['event'], ORDER_CREATED)
+            self.assertEqual(message['order']['id'], order.id)
+            self.assertEqual(message['order']['total'], '45.50')
+            await communicator.disconnect()
+
+        with mock.patch.object(OrdersConsumer, '__authorize__', return_value = True):
+            async_to_sync(run)()
+
+class RestaurantAdminTests(TestCase):
+    def setUp(self):
+        self.owner = create_appuser()
+        self.other = create_appuser('other', '0772222222')
+        self.restaurants = [create_restaurant(self.owner, 'Burger Palace'), create_restaurant(self.owner, 'Chicken Inn'),
+                            create_restaurant(self.other, 'Pizza Hut')]
+        RestaurantsService().clear_admin(self.owner.id, self.other.id)
+
+    def has_permission(self, restaurant_id, data):
+        request = mock.Mock(appuser_id = self.owner.id, data = data)
+        return RestaurantAdmin().has_permission(request, mock.Mock(kwargs = {'restaurant_id': restaurant_id}))
+
+    def test_checks_every_named_restaurant_in_one_query(self):
+        mine, also_mine, theirs = self.restaurants
+
+        with self.assertNumQueries(1):
+            self.assertFalse(self.has_permission(mine.id, {'name': 'Mains', 'restaurant': theirs.id}))
+        with self.assertNumQueries(1):
+            self.assertTrue(self.has_permission(mine.id, {'name': 'Mains', 'restaurant': str(also_mine.id)}))
+        with self.assertNumQueries(0):
+            self.assertTrue(self.has_permission(mine.id, {'restaurant': also_mine.id}))
+            self.assertFalse(self.has_permission(None, {}))
+
+    def test_batched_lookups_make_one_query(self):
+        mine, also_mine, theirs = self.restaurants
+        AppUsersCache().delete_many([f'get_appuser_id_by_user_id/?user_id={appuser.user_id}' for appuser in (self.owner, self.other)])
+
+        with self.assertNumQueries(1):
+            admin = RestaurantsService().check_admin_many(self.owner.id, [mine.id, also_mine.id, theirs.id])
+        self.assertEqual(admin, {mine.id: True, also_mine.id: True, theirs.id: False})
+
+        with self.assertNumQueries(1):
+            appuser_ids = AppUserService().get_appuser_ids_by_user_ids([self.owner.user_id, self.other.user_id])
+        self.assertEqual(appuser_ids, {self.owner.user_id: self.owner.id, self.other.user_id: self.other.id})
+        with self.assertNumQueries(0):
+            AppUserService().get_appuser_ids_by_user_ids([self.owner.user_id, self.other.user_id])
@@ -11,6 +11,7 @@ urlpatterns = [
     path('option-categories/<int:id>/update/', views.UpdateOptionCategory.as_view()),
     path('categories/<int:id>/update/', views.UpdateCategory.as_view()),
     path('restaurants/<int:restaurant_id>/categories/add/', views.AddCategory.as_view()),
+    path('restaurants/<int:restaurant_id>/menu/import/', views.ImportMenu.as_view()),
     path('orders/<int:restaurant_id>/', views.GetOrders.as_view()),
     path('orders/<int:order_id>/accept', views.AcceptOrder.as_view())
 ]
@@ -10,6 +10,9 @@ from services.category_service import CategoryService
 from services.appuser_service import AppUserService
 from services.menu_service import MenuService
 from services.order_service import OrderService
+from services.menu_import_service import MenuImportService, MenuImportError, FORMAT_CSV, FORMAT_JSON
+from services.cache.validators import conditional
+from services.cache.tags import orders_tag
 from .permissions import *
 from domain.serializers import *
 from services.http_response import OK, INTERNAL_SERVER_ERROR, CREATED, BAD_REQUEST
@@ -72,7 +75,10 @@ class GetRestaurants(ListAPIView):
        self._restaurants_service = RestaurantsService() 
 
     def get(self, request):
-        restaurants = self._restaurants_service.get_by_appuser(request.appuser_id)
+        restaurants = self._restaurants_service.get_by_appuser(request.appuser_id,
+                        request.query_params.get('page', 1),
+                        request.query_params.get('size', 10),
+                        request.query_params.get('cursor', None))
         resp = restaurants.serialize_data(RestaurantsListResponseSerializerAdmin)
         return Response(resp)
 
@@ -113,6 +119,31 @@ class UpdateMenuItem(UpdateAPIView):
         
         return OK()
 
+class ImportMenu(CreateAPIView):
+    '''
+        Import a whole menu in one request, either as the JSON body or as an uploaded .json or .csv file
+    '''
+    permission_classes = (PlaceAdmin, RestaurantAdmin)
+
+    def __init__(self):
+        self._menu_import = MenuImportService()
+
+    @method_decorator(csrf_protect)
+    def post(self, request, restaurant_id):
+        upload = request.FILES.get('file', None)
+        try:
+            if upload == None:
+                data = request.data
+            else:
+                format = FORMAT_CSV if upload.name.lower().endswith('.csv') else FORMAT_JSON
+                data = self._menu_import.parse(upload.read(), format)
+            created = self._menu_import.import_menu(restaurant_id, data)
+        except MenuImportError as e:
+            return BAD_REQUEST(e.errors)
+
+        logger.info(f'Imported the menu of restaurant {restaurant_id}: {created}')
+        return Response(created, status = status.HTTP_201_CREATED)
+
 class AddCategory(CreateAPIView):
     permission_classes = (PlaceAdmin, RestaurantAdmin)
 
@@ -155,9 +186,8 @@ class GetOptionCategories(ListAPIView):
         self._option_category_service = OptionCategoryService()
 
     def get(self, request, restaurant):
-        option_categories = self._option_category_service.get_by_restaurant(restaurant)   
-        serializer = OptionCategoryListSerializer(option_categories, many = True)
-        return OK(serializer.data)
+        option_categories = self._option_category_service.get_by_restaurant(restaurant)
+        return OK(option_categories)
 
 class AddOptionCategory(CreateAPIView):
     permission_classes = (PlaceAdmin, RestaurantAdmin)
@@ -186,6 +216,7 @@ class GetOrders(ListAPIView):
     def __init__(self):
         self._order_service = OrderService()
 
+    @conditional(lambda request, restaurant_id: (orders_tag(restaurant_id),), daily = True)
     def get(self, request, restaurant_id):
         orders = self._order_service.get_todays_pending_orders(restaurant_id)
         serializer = OrderResponseSerializer(orders, many = True)
@@ -3,9 +3,12 @@ from django.conf import settings
 
 from domain.models import AppUser
 from services.cache import app_users_cache
+from utils.app_logger import get_logger
 from .user_service import UserService
 from .base.service_base import ServiceBase
 
+logger = get_logger(__name__)
+
 class AppUserService(ServiceBase):
     def __init__(self, **kwargs):
         self.cache = app_users_cache.AppUsersCache()
@@ -36,20 +39,34 @@ class AppUserService(ServiceBase):
     def get_appuser_id_by_user_id(self, user_id):
         key = f'get_appuser_id_by_user_id/?user_id={user_id}'
 
-        appuser_id = self.cache.get(key, None)
-
-        if appuser_id != None:
-            return appuser_id
-
-        field_list = ('id',)
-        result = self.get_fields(field_list, **{
-                     'user_id': user_id
-                 })
-
-        appuser_id = result[0]['id'] if result else None
-        self.cache.set(key, appuser_id, settings.FIFTEEN_MINUTES)
-
-        return appuser_id
+        def load():
+            field_list = ('id',)
+            result = self.get_fields(field_list, **{
+                         'user_id': user_id
+                     })
+            return result[0]['id'] if result else None
+
+        return self.cache.get_or_compute(key, load, settings.FIFTEEN_MINUTES)
+
+    def get_appuser_ids_by_user_ids(self, user_ids):
+        '''
+            Batched get_appuser_id_by_user_id: one cache round trip and at most one query. Returns {user_id: appuser_id}
+        '''
+        keys = {f'get_appuser_id_by_user_id/?user_id={user_id}': user_id for user_id in user_ids}
+
+        def load(missing):
+            ids = dict(AppUser.objects.filter(user_id__in = [keys[key] for key in missing]).values_list('user_id', 'id'))
+            return {key: ids.get(keys[key]) for key in missing}
+
+        result = self.cache.get_or_compute_many(list(keys), load, settings.FIFTEEN_MINUTES)
+        return {keys[key]: appuser_id for key, appuser_id in result.items()}
+
+    def get_many_by_email(self, emails):
+        '''
+            Loads the appusers of several emails in one query. Returns {email: appuser}
+        '''
+        appusers = AppUser.objects.select_related('user').filter(user__email__in = emails)
+        return {appuser.user.email: appuser for appuser in appusers}
 
     def update(self, appuser_id, **kwargs):
         appuser = self.get(appuser_id)
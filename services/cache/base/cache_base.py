@@ -1,41 +1,506 @@
+import math, random, time
+
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from django import db
+from django.conf import settings
 from django.core.cache import cache
+from django_redis import get_redis_connection
 from services.pagination_service import PagedCollection
+from .local_cache import local_cache, invalidation_bus
+from .metrics import cache_metrics
+from utils.app_logger import get_logger
+
+logger = get_logger(__name__)
+
+MISSING = object()
+LOCK_POLL_INTERVAL = 0.05
+DEFAULT_COLLECTION_SIZE = 100
+REFRESH_ERRORS_PREFIX = 'cache_'
+REFRESH_ERRORS_KEY = 'refresh_errors'
+
+# How get_or_compute stores what its loader returns
+ComputePolicy = namedtuple('ComputePolicy', ('timeout', 'cache_none', 'codec', 'stale_timeout', 'negative_timeout'))
+
+# Runs stale-while-revalidate refreshes off the request thread
+refresh_executor = ThreadPoolExecutor(max_workers = settings.CACHE_REFRESH_WORKERS, thread_name_prefix = 'cache-refresh')
+
+# What get_or_compute stores: the value, how long the loader took and when the value expires
+CachedValue = namedtuple('CachedValue', ('value', 'delta', 'expires'))
 
 class CacheBase():
     '''
-        The base cache class
+        The base cache class. Reads go through a small per process LRU (settings.CACHE_L1) before Redis;
+        writes are broadcast so other processes drop their local copy.
     '''
-    
-    def __init__(self, prefix):
+
+    def __init__(self, prefix, use_local = None):
         '''
             Constructor
 
             @prefix is the cache prefix to use
+            @use_local turns the in-process tier on or off for this cache, defaults to settings.CACHE_L1['ENABLED']
         '''
         self.prefix = prefix
-        
+        self.use_local = settings.CACHE_L1['ENABLED'] if use_local == None else use_local
+        if self.use_local:
+            invalidation_bus.start()
+
+    def make_key(self, key):
+        return f'{self.prefix}{key}'.lower()
 
     def get(self, key, default=None):
         '''
             Get a value from the cache by
         '''
 
-        print(f'Getting {key} from cache')
-        return cache.get(f'{self.prefix}{key}'.lower(), default)
-    
+        full_key = self.make_key(key)
+
+        if self.use_local:
+            found, value = local_cache.get(full_key)
+            if found:
+                cache_metrics.hit(self.prefix, key, local = True)
+                return value
+
+        started = time.perf_counter()
+        value = cache.get(full_key, MISSING)
+        cache_metrics.redis(self.prefix, key, time.perf_counter() - started)
+
+        if value is MISSING:
+            cache_metrics.miss(self.prefix, key)
+            return default
+
+        cache_metrics.hit(self.prefix, key)
+        if self.use_local:
+            local_cache.set(full_key, value)
+        return value
+
     def set(self, key, value, timeout = 15):
-        return cache.set(f'{self.prefix}{key}'.lower(), value, timeout)
+        full_key = self.make_key(key)
+
+        started = time.perf_counter()
+        result = cache.set(full_key, value, timeout)
+        cache_metrics.redis(self.prefix, key, time.perf_counter() - started)
+        cache_metrics.set(self.prefix, key, self.__payload__(value))
+
+        if self.use_local:
+            local_cache.set(full_key, value, timeout)
+            invalidation_bus.publish(full_key)
+        return result
+
+    def add(self, key, value, timeout = 15):
+        '''
+            Sets @key only if it is not set yet, atomically. Returns whether it was set
+        '''
+        full_key = self.make_key(key)
+
+        started = time.perf_counter()
+        added = cache.add(full_key, value, timeout)
+        cache_metrics.redis(self.prefix, key, time.perf_counter() - started)
+
+        if added:
+            cache_metrics.set(self.prefix, key, self.__payload__(value))
+            if self.use_local:
+                local_cache.delete(full_key)
+                invalidation_bus.publish(full_key)
+        return added
+
+    def __payload__(self, value):
+        return value.value if isinstance(value, CachedValue) else value
+
+    def delete(self, key):
+        cache_metrics.delete(self.prefix, key)
+        key = self.make_key(key)
+        result = cache.delete(key)
+
+        if self.use_local:
+            local_cache.delete(key)
+            invalidation_bus.publish(key)
+        return result
+
+    def get_many(self, keys):
+        '''
+            Returns {key: value} for the @keys found, reading Redis with a single MGET for the ones not held locally
+        '''
+        full_keys = {self.make_key(key): key for key in keys}
+        found = {}
+
+        if self.use_local:
+            for full_key, key in full_keys.items():
+                hit, value = local_cache.get(full_key)
+                if hit:
+                    found[key] = value
+
+        for key in found:
+            cache_metrics.hit(self.prefix, key, local = True)
+
+        missing = [full_key for full_key, key in full_keys.items() if key not in found]
+        if missing:
+            started = time.perf_counter()
+            fetched = cache.get_many(missing)
+            cache_metrics.redis(self.prefix, full_keys[missing[0]], time.perf_counter() - started)
+
+            for full_key in missing:
+                key = full_keys[full_key]
+                if full_key not in fetched:
+                    cache_metrics.miss(self.prefix, key)
+                    continue
+                cache_metrics.hit(self.prefix, key)
+                found[key] = fetched[full_key]
+                if self.use_local:
+                    local_cache.set(full_key, fetched[full_key])
+
+        return found
+
+    def set_many(self, mapping, timeout = 15):
+        '''
+            Writes every key of @mapping in one pipelined round trip
+        '''
+        if not mapping:
+            return
+        full_mapping = {self.make_key(key): value for key, value in mapping.items()}
+
+        started = time.perf_counter()
+        cache.set_many(full_mapping, timeout)
+        cache_metrics.redis(self.prefix, next(iter(mapping)), time.perf_counter() - started)
+        for key, value in mapping.items():
+            cache_metrics.set(self.prefix, key, self.__payload__(value))
+
+        if self.use_local and full_mapping:
+            for full_key, value in full_mapping.items():
+                local_cache.set(full_key, value, timeout)
+            invalidation_bus.publish(*full_mapping.keys())
+
+    def delete_many(self, keys):
+        full_keys = [self.make_key(key) for key in keys]
+        if not full_keys:
+            return
+        for key in keys:
+            cache_metrics.delete(self.prefix, key)
+        cache.delete_many(full_keys)
+
+        if self.use_local:
+            local_cache.delete(*full_keys)
+            invalidation_bus.publish(*full_keys)
+
+    def get_or_compute_many(self, keys, loader, timeout = 15, cache_none = False, codec = None):
+        '''
+            Batched get_or_compute: @loader(missing_keys) returns {key: value} for the keys that were not cached,
+            which are then written back with one set_many. There is no single flight locking for batches.
+        '''
+        result = {}
+        for key, entry in self.get_many(keys).items():
+            if not isinstance(entry, CachedValue):
+                continue
+            value = codec.decode(entry.value) if codec != None else entry.value
+            if value != None:
+                result[key] = value
+
+        missing = [key for key in keys if key not in result]
+        if not missing:
+            return result
+
+        started = time.time()
+        loaded = loader(missing)
+        delta = time.time() - started
+        expires = time.time() + timeout if timeout else None
+
+        to_cache = {}
+        for key in missing:
+            value = loaded.get(key)
+            result[key] = value
+            if value != None or cache_none:
+                to_cache[key] = CachedValue(self.__encode__(key, value, codec), delta, expires)
+        if to_cache:
+            self.set_many(to_cache, timeout)
+
+        return result
+
+    def __generation_key__(self, tag):
+        return f'generation/{tag}'.lower()
+
+    def generations(self, tags):
+        '''
+            Returns the current generation of every tag. Tags are shared by all caches, whatever their prefix
+        '''
+        keys = [self.__generation_key__(tag) for tag in tags]
+        found = {}
+        if self.use_local:
+            for key in keys:
+                hit, value = local_cache.get(key)
+                if hit:
+                    found[key] = value
+
+        missing = [key for key in keys if key not in found]
+        if missing:
+            fetched = cache.get_many(missing)
+            for key in missing:
+                found[key] = fetched.get(key, 0)
+                if self.use_local:
+                    local_cache.set(key, found[key])
+
+        return [found[key] for key in keys]
+
+    def __touched_key__(self, tag):
+        return f'touched/{tag}'.lower()
+
+    def touched(self, tags):
+        '''
+            Returns when any of @tags was last bumped, as a unix timestamp, or None if none of them ever was
+        '''
+        stamps = [stamp for stamp in cache.get_many([self.__touched_key__(tag) for tag in tags]).values() if stamp != None]
+        return max(stamps) if stamps else None
+
+    def bump(self, *tags):
+        '''
+            Moves every key tagged with any of @tags to a new generation, so they are never read again
+        '''
+        keys = [self.__generation_key__(tag) for tag in tags]
+        for key in keys:
+            if cache.add(key, 1, None):
+                continue
+            try:
+                cache.incr(key)
+            except ValueError:
+                cache.set(key, 1, None)
+
+        now = time.time()
+        cache.set_many({self.__touched_key__(tag): now for tag in tags}, None)
 
-    def add_or_update(self, key, value):
-        cached = self.get(key.lower(), None)
-        if cached == None:
-            cached = []
+        if self.use_local and keys:
+            local_cache.delete(*keys)
+            invalidation_bus.publish(*keys)
 
-        if value in cached:
-            cached.remove(value)
-            cached.append(value)
-        else:
-            cached.append(value)
-        self.set(key, cached)
+    def tagged_key(self, key, tags):
+        if not tags:
+            return key
+        return f'{key}@' + '.'.join(str(generation) for generation in self.generations(tags))
 
-    
\ No newline at end of file
+    def get_or_compute(self, key, loader, timeout = 15, cache_none = False, beta = 1.0, lock_timeout = 10, wait = 5, tags = (), codec = None, stale_timeout = None, negative_timeout = None):
+        '''
+            Returns the cached value of @key, calling @loader() and caching its result on a miss.
+
+            Only one worker at a time runs the loader for a key; the others poll for its result for
+            up to @wait seconds before giving up and loading it themselves. A waiter that finds the lock
+            released with nothing cached (an uncached None) takes the lock and loads at once.
+            With @beta > 0 a worker recomputes the value before it expires, with a probability that
+            grows as expiry nears and with how slow the loader is (XFetch). Pass beta = 0 to disable.
+            None results are only cached when @cache_none is set.
+            @tags (see bump) fold the tags' generations into the key.
+            @codec (see codec.RowsCodec) stores the value encoded instead of pickled.
+            @stale_timeout turns on stale-while-revalidate: after @stale_timeout seconds the value is still
+            served, up to the hard @timeout, while a single background refresh rebuilds it.
+            @negative_timeout caches None results (not found) for that many seconds; clear them with delete
+            when the missing entity gets created.
+        '''
+        policy = ComputePolicy(timeout, cache_none, codec, stale_timeout, negative_timeout)
+        key = self.tagged_key(key, tags)
+        entry = self.__read__(key, codec)
+        if entry != None:
+            if stale_timeout != None:
+                stale = entry.expires != None and time.time() >= entry.expires
+                if (stale or self.__should_refresh__(entry, beta)) and self.__acquire__(key, lock_timeout):
+                    refresh_executor.submit(self.__refresh__, key, loader, policy)
+                return entry.value
+
+            if not self.__should_refresh__(entry, beta) or not self.__acquire__(key, lock_timeout):
+                return entry.value
+            return self.__compute__(key, loader, policy)
+
+        if self.__acquire__(key, lock_timeout):
+            return self.__compute__(key, loader, policy)
+
+        deadline = time.monotonic() + wait
+        while time.monotonic() < deadline:
+            time.sleep(LOCK_POLL_INTERVAL)
+            entry = self.__read__(key, codec)
+            if entry != None:
+                return entry.value
+            if self.__acquire__(key, lock_timeout):
+                return self.__compute__(key, loader, policy)
+
+        return loader()
+
+    def __read__(self, key, codec):
+        entry = self.get(key, None)
+        if not isinstance(entry, CachedValue):
+            return None
+        if codec == None or entry.value == None:
+            return entry
+        value = codec.decode(entry.value)
+        return entry._replace(value = value) if value != None else None
+
+    def __encode__(self, key, value, codec):
+        if codec == None or value == None:
+            return value
+        return codec.encode(value)
+
+    def __should_refresh__(self, entry, beta):
+        if beta <= 0 or entry.expires == None:
+            return False
+        return time.time() - entry.delta * beta * math.log(1 - random.random()) >= entry.expires
+
+    def __lock_key__(self, key):
+        return self.make_key(f'{key}#lock')
+
+    def __acquire__(self, key, lock_timeout):
+        return cache.add(self.__lock_key__(key), 1, lock_timeout)
+
+    def __refresh__(self, key, loader, policy):
+        try:
+            self.__compute__(key, loader, policy)
+        except Exception as e:
+            logger.exception(f'Could not refresh {self.make_key(key)} in the background')
+            record_refresh_error(self.make_key(key), e)
+        finally:
+            db.connections.close_all()
+
+    def __compute__(self, key, loader, policy):
+        try:
+            started = time.time()
+            value = loader()
+            delta = time.time() - started
+
+            if value == None and policy.negative_timeout:
+                self.set(key, CachedValue(None, delta, time.time() + policy.negative_timeout), policy.negative_timeout)
+            elif value != None or policy.cache_none:
+                fresh_for = policy.stale_timeout or policy.timeout
+                expires = time.time() + fresh_for if fresh_for else None
+                self.set(key, CachedValue(self.__encode__(key, value, policy.codec), delta, expires), policy.timeout)
+            return value
+        finally:
+            cache.delete(self.__lock_key__(key))
+
+    def __redis__(self):
+        return get_redis_connection('default')
+
+    def __decode__(self, value):
+        return value.decode() if isinstance(value, bytes) else value
+
+    def __timed__(self, key, operation):
+        started = time.perf_counter()
+        result = operation()
+        cache_metrics.redis(self.prefix, key, time.perf_counter() - started)
+        return result
+
+    def __raw_key__(self, key):
+        # the key django-redis stores @key under, so delete() and KEY_PREFIX also apply to collections
+        return cache.make_key(self.make_key(key))
+
+    def add_or_update(self, key, value, max_size, timeout):
+        '''
+            Adds or moves @value to the most recent end of the collection @key, a sorted set scored by time,
+            and trims it to the @max_size most recent values. Atomic, and the collection is never read back.
+            The collection expires @timeout seconds after its last update
+        '''
+        full_key = self.__raw_key__(key)
+
+        def operation():
+            pipeline = self.__redis__().pipeline(transaction = True)
+            pipeline.zadd(full_key, time.time(), value)
+            pipeline.zremrangebyrank(full_key, 0, -max_size - 1)
+            pipeline.expire(full_key, timeout)
+            return pipeline.execute()
+
+        self.__timed__(key, operation)
+        cache_metrics.set(self.prefix, key)
+
+    def recent_since(self, key, since):
+        '''
+            Returns the values of a collection kept by add_or_update that were added or moved at or after
+            the unix timestamp @since, oldest first. Values come back as str
+        '''
+        full_key = self.__raw_key__(key)
+        values = self.__timed__(key, lambda: self.__redis__().zrangebyscore(full_key, since, '+inf'))
+        return [self.__decode__(value) for value in values]
+
+    def list_push(self, key, value, max_size, timeout):
+        '''
+            Pushes @value to the head of the capped list @key and trims it to @max_size values, atomically.
+            The list expires @timeout seconds after its last push
+        '''
+        full_key = self.__raw_key__(key)
+
+        def operation():
+            pipeline = self.__redis__().pipeline(transaction = True)
+            pipeline.lpush(full_key, value)
+            pipeline.ltrim(full_key, 0, max_size - 1)
+            pipeline.expire(full_key, timeout)
+            return pipeline.execute()
+
+        self.__timed__(key, operation)
+        cache_metrics.set(self.prefix, key)
+
+    def list_range(self, key, count):
+        '''
+            Returns up to @count values of a list kept by list_push, most recent first, as str
+        '''
+        full_key = self.__raw_key__(key)
+        values = self.__timed__(key, lambda: self.__redis__().lrange(full_key, 0, count - 1))
+        return [self.__decode__(value) for value in values]
+
+    def set_add(self, key, members, timeout):
+        '''
+            Adds @members to the set @key, which expires @timeout seconds later
+        '''
+        full_key = self.__raw_key__(key)
+
+        def operation():
+            pipeline = self.__redis__().pipeline(transaction = True)
+            pipeline.sadd(full_key, *members)
+            pipeline.expire(full_key, timeout)
+            return pipeline.execute()
+
+        self.__timed__(key, operation)
+        cache_metrics.set(self.prefix, key)
+
+    def members(self, key):
+        '''
+            Returns the members of the set @key as str, an empty set when it does not exist
+        '''
+        full_key = self.__raw_key__(key)
+        members = self.__timed__(key, lambda: self.__redis__().smembers(full_key))
+        return set(self.__decode__(member) for member in members)
+
+    def hash_set(self, key, mapping, timeout):
+        '''
+            Sets the fields of @mapping in the hash @key, which expires @timeout seconds later
+        '''
+        full_key = self.__raw_key__(key)
+
+        def operation():
+            pipeline = self.__redis__().pipeline(transaction = True)
+            pipeline.hmset(full_key, mapping)
+            pipeline.expire(full_key, timeout)
+            return pipeline.execute()
+
+        self.__timed__(key, operation)
+        cache_metrics.set(self.prefix, key)
+
+    def hash_get(self, key, fields):
+        '''
+            Returns {field: value} for @fields of the hash @key, values as str and None for missing fields
+        '''
+        full_key = self.__raw_key__(key)
+        values = self.__timed__(key, lambda: self.__redis__().hmget(full_key, fields))
+        return {field: self.__decode__(value) for field, value in zip(fields, values)}
+
+def __refresh_errors_cache__():
+    return CacheBase(REFRESH_ERRORS_PREFIX, use_local = False)
+
+def record_refresh_error(key, error):
+    '''
+        Keeps a failed background refresh of @key in a capped list shared by every process, see refresh_errors
+    '''
+    try:
+        entry = f'{time.strftime("%Y-%m-%dT%H:%M:%S")} {key}: {error!r}'
+        __refresh_errors_cache__().list_push(REFRESH_ERRORS_KEY, entry, DEFAULT_COLLECTION_SIZE, settings.ONE_DAY)
+    except Exception:
+        logger.exception(f'Could not record the failed refresh of {key}')
+
+def refresh_errors(count = DEFAULT_COLLECTION_SIZE):
+    '''
+        The most recent failed background refreshes of any process, newest first. They are only logged otherwise,
+        the request that triggered them was already served the stale value
+    '''
+    return __refresh_errors_cache__().list_range(REFRESH_ERRORS_KEY, count)
@@ -0,0 +1,35 @@
+import json, zlib
+
+from django.core.serializers.json import DjangoJSONEncoder
+
+RAW = b'\x00'
+COMPRESSED = b'\x01'
+
+class RowsCodec():
+    '''
+        Encodes plain, serializer ready rows (dicts, lists, strings, numbers) for the cache instead of pickling
+        model instances. The payload is compact JSON tagged with @schema, zlib compressed once it grows past
+        @compress_threshold bytes. Payloads written under another schema decode to None and are treated as misses,
+        so bump the schema whenever the shape of the rows changes.
+    '''
+    def __init__(self, schema, compress_threshold = 1024, level = 6):
+        self.schema = schema
+        self.compress_threshold = compress_threshold
+        self.level = level
+
+    def encode(self, rows):
+        payload = json.dumps([self.schema, rows], cls = DjangoJSONEncoder, separators = (',', ':')).encode()
+        if len(payload) > self.compress_threshold:
+            return COMPRESSED + zlib.compress(payload, self.level)
+        return RAW + payload
+
+    def decode(self, payload):
+        if not isinstance(payload, bytes) or not payload:
+            return None
+        flag, body = payload[:1], payload[1:]
+        if flag == COMPRESSED:
+            body = zlib.decompress(body)
+        schema, rows = json.loads(body.decode())
+        if schema != self.schema:
+            return None
+        return rows
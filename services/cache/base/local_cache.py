@@ -0,0 +1,111 @@
+import json, pickle, time, threading, uuid
+
+from collections import OrderedDict
+from django.conf import settings
+from utils.app_logger import get_logger
+
+logger = get_logger(__name__)
+
+INVALIDATION_CHANNEL = 'cache_invalidation'
+RECONNECT_DELAY = 5
+
+class LocalCache():
+    '''
+        Bounded, per process LRU cache. Entries live at most @ttl seconds so that
+        a missed invalidation can never serve a stale value for long.
+        Values are kept pickled and every get returns a fresh copy, so a caller changing
+        what it got back can never change what the next request reads.
+    '''
+    def __init__(self, max_size = 2048, ttl = 5):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        '''
+            Returns (found, value)
+        '''
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry == None:
+                return False, None
+            expires, value = entry
+            if expires < time.monotonic():
+                del self.entries[key]
+                return False, None
+            self.entries.move_to_end(key)
+        return True, pickle.loads(value)
+
+    def set(self, key, value, timeout = None):
+        ttl = self.ttl if not timeout else min(self.ttl, timeout)
+        value = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        with self.lock:
+            self.entries[key] = (time.monotonic() + ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last = False)
+
+    def delete(self, *keys):
+        with self.lock:
+            for key in keys:
+                self.entries.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+class InvalidationBus():
+    '''
+        Broadcasts written keys over Redis pub/sub so that every other process drops them from its LocalCache
+    '''
+    def __init__(self, local_cache):
+        self.local_cache = local_cache
+        self.origin = uuid.uuid4().hex
+        self.listener = None
+        self.lock = threading.Lock()
+
+    def __connection__(self):
+        from django_redis import get_redis_connection
+        return get_redis_connection('default')
+
+    def publish(self, *keys):
+        self.start()
+        try:
+            self.__connection__().publish(INVALIDATION_CHANNEL, json.dumps({'origin': self.origin, 'keys': keys}))
+        except Exception:
+            logger.exception('Could not publish cache invalidation')
+
+    def start(self):
+        if self.listener != None:
+            return
+        with self.lock:
+            if self.listener == None:
+                self.listener = threading.Thread(target = self.__listen__, name = 'cache-invalidation', daemon = True)
+                self.listener.start()
+
+    def __listen__(self):
+        while True:
+            try:
+                pubsub = self.__connection__().pubsub(ignore_subscribe_messages = True)
+                pubsub.subscribe(INVALIDATION_CHANNEL)
+                # anything published while we were not subscribed is lost
+                self.local_cache.clear()
+                for message in pubsub.listen():
+                    self.__handle__(message)
+            except Exception:
+                logger.exception('Cache invalidation listener disconnected')
+                self.local_cache.clear()
+                time.sleep(RECONNECT_DELAY)
+
+    def __handle__(self, message):
+        if message.get('type') != 'message':
+            return
+        payload = json.loads(message['data'])
+        if payload['origin'] != self.origin:
+            self.local_cache.delete(*payload['keys'])
+
+
+local_cache = LocalCache(settings.CACHE_L1['MAX_SIZE'], settings.CACHE_L1['TTL'])
+invalidation_bus = InvalidationBus(local_cache)
@@ -0,0 +1,102 @@
+import re, threading
+
+from bisect import bisect_left
+from collections import defaultdict
+
+# upper bounds, in seconds, of the redis latency histogram buckets. The last bucket catches everything slower
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25)
+FAMILY_SEPARATORS = re.compile(r'[/?@#&=]')
+
+def key_family(key):
+    '''
+        The family of a cache key is its leading name, e.g. get_menu_document for get_menu_document/?name=x.
+        Keys without a name, like a bare id, all fall in 'other' so that they cannot grow the families without bound
+    '''
+    family = FAMILY_SEPARATORS.split(str(key), 1)[0]
+    if not family or family.isdigit():
+        return 'other'
+    return family
+
+class Stats():
+    def __init__(self):
+        self.hits = 0
+        self.local_hits = 0
+        self.misses = 0
+        self.sets = 0
+        self.deletes = 0
+        self.bytes = 0
+        self.redis_calls = 0
+        self.redis_seconds = 0.0
+        self.latency = [0] * (len(LATENCY_BUCKETS) + 1)
+
+    def as_dict(self):
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'local_hits': self.local_hits,
+            'misses': self.misses,
+            'hit_ratio': round(self.hits / lookups, 4) if lookups else None,
+            'sets': self.sets,
+            'deletes': self.deletes,
+            'bytes_written': self.bytes,
+            'redis_calls': self.redis_calls,
+            'redis_ms': round(self.redis_seconds * 1000, 3),
+            'redis_latency_ms': {
+                (f'<={bound * 1000:g}' if i < len(LATENCY_BUCKETS) else f'>{LATENCY_BUCKETS[-1] * 1000:g}'): count
+                for i, (bound, count) in enumerate(zip(LATENCY_BUCKETS + (None,), self.latency))
+            }
+        }
+
+class CacheMetrics():
+    '''
+        Per process counters and redis latency histograms, by cache prefix and key family.
+        Recording is a dict lookup and a few integer additions under a lock.
+    '''
+    def __init__(self):
+        self.stats = defaultdict(Stats)
+        self.lock = threading.Lock()
+
+    def __stats__(self, prefix, key):
+        return self.stats[(prefix, key_family(key))]
+
+    def hit(self, prefix, key, local = False):
+        with self.lock:
+            stats = self.__stats__(prefix, key)
+            stats.hits += 1
+            if local:
+                stats.local_hits += 1
+
+    def miss(self, prefix, key):
+        with self.lock:
+            self.__stats__(prefix, key).misses += 1
+
+    def set(self, prefix, key, value = None):
+        with self.lock:
+            stats = self.__stats__(prefix, key)
+            stats.sets += 1
+            if isinstance(value, (bytes, bytearray)):
+                stats.bytes += len(value)
+
+    def delete(self, prefix, key):
+        with self.lock:
+            self.__stats__(prefix, key).deletes += 1
+
+    def redis(self, prefix, key, seconds):
+        with self.lock:
+            stats = self.__stats__(prefix, key)
+            stats.redis_calls += 1
+            stats.redis_seconds += seconds
+            stats.latency[bisect_left(LATENCY_BUCKETS, seconds)] += 1
+
+    def snapshot(self):
+        with self.lock:
+            result = defaultdict(dict)
+            for (prefix, family), stats in self.stats.items():
+                result[prefix][family] = stats.as_dict()
+            return dict(result)
+
+    def reset(self):
+        with self.lock:
+            self.stats.clear()
+
+cache_metrics = CacheMetrics()
@@ -0,0 +1,7 @@
+from .base import cache_base
+
+CACHE_PREFIX = 'chatrooms_'
+
+class ChatCache(cache_base.CacheBase):
+    def __init__(self):
+        super(ChatCache, self).__init__(CACHE_PREFIX)
@@ -0,0 +1,8 @@
+from .base import cache_base
+
+CACHE_PREFIX = 'idempotency_'
+
+class IdempotencyCache(cache_base.CacheBase):
+    def __init__(self):
+        # reservations must be seen by every process at once, never from a local copy
+        super(IdempotencyCache, self).__init__(CACHE_PREFIX, use_local = False)
@@ -0,0 +1,47 @@
+import math
+
+from .base import cache_base
+from .tags import tile_tag
+
+CACHE_PREFIX = 'nearby_'
+METERS_PER_DEGREE = 111320
+
+class NearbyCache(cache_base.CacheBase):
+    '''
+        Caches the restaurants around a snapped location. Every candidate set is tagged with the
+        coarse tiles it overlaps, so a restaurant change only has to bump its own tile.
+    '''
+    def __init__(self, cell_size, tile_size):
+        super(NearbyCache, self).__init__(CACHE_PREFIX)
+        self.cell_size = cell_size
+        self.tile_size = tile_size
+
+    def snap(self, lat, lng):
+        '''
+            Returns the (row, col) of the cell containing a location and the cell's center
+        '''
+        cell = (math.floor(float(lat) / self.cell_size), math.floor(float(lng) / self.cell_size))
+        center = ((cell[0] + 0.5) * self.cell_size, (cell[1] + 0.5) * self.cell_size)
+        return cell, center
+
+    def cell_radius(self, radius):
+        '''
+            The radius around a cell's center that covers @radius from any point of the cell
+        '''
+        return radius + self.cell_size * METERS_PER_DEGREE * math.sqrt(2) / 2
+
+    def tile(self, lat, lng):
+        return (math.floor(float(lat) / self.tile_size), math.floor(float(lng) / self.tile_size))
+
+    def tiles_around(self, lat, lng, radius):
+        lat_span = radius / METERS_PER_DEGREE
+        lng_span = radius / (METERS_PER_DEGREE * max(math.cos(math.radians(lat)), 0.01))
+        min_row, min_col = self.tile(lat - lat_span, lng - lng_span)
+        max_row, max_col = self.tile(lat + lat_span, lng + lng_span)
+        return [(row, col) for row in range(min_row, max_row + 1) for col in range(min_col, max_col + 1)]
+
+    def tile_tags(self, lat, lng, radius):
+        return [tile_tag(tile) for tile in self.tiles_around(lat, lng, radius)]
+
+    def bump_location(self, lat, lng):
+        self.bump(tile_tag(self.tile(lat, lng)))
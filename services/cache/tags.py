@@ -0,0 +1,21 @@
+'''
+    Tags for CacheBase generations. Bumping a tag invalidates every key cached with it.
+'''
+
+def restaurants_tag():
+    '''
+        Every restaurant listing: search results, nearby restaurants and the geo index changes
+    '''
+    return 'restaurants'
+
+def restaurant_tag(restaurant_id):
+    return f'restaurant:{restaurant_id}'
+
+def appuser_restaurants_tag(appuser_id):
+    return f'appuser_restaurants:{appuser_id}'
+
+def tile_tag(tile):
+    return f'tile:{tile[0]},{tile[1]}'
+
+def orders_tag(restaurant_id):
+    return f'orders:{restaurant_id}'
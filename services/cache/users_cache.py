@@ -0,0 +1,7 @@
+from .base import cache_base
+
+CACHE_PREFIX = 'users_'
+
+class UsersCache(cache_base.CacheBase):
+    def __init__(self):
+        super(UsersCache, self).__init__(CACHE_PREFIX)
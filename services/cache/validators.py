@@ -0,0 +1,69 @@
+import datetime, hashlib
+
+from django.utils import timezone
+from django.utils.decorators import method_decorator
+from django.views.decorators.http import condition
+from .base.cache_base import CacheBase
+
+CACHE_PREFIX = 'validators_'
+
+class Validators():
+    '''
+        ETag and Last-Modified values of a response, derived from the generations of the cache tags it
+        depends on and from when those tags were last bumped. Computing them is one or two cache reads.
+    '''
+    def __init__(self):
+        self.cache = CacheBase(CACHE_PREFIX)
+
+    def etag(self, tags, *parts):
+        raw = '|'.join(str(part) for part in parts + tuple(self.cache.generations(tags)))
+        return hashlib.sha1(raw.encode()).hexdigest()
+
+    def last_modified(self, tags, since = None):
+        '''
+            When any of @tags was last bumped, no earlier than @since
+        '''
+        touched = self.cache.touched(tags)
+        if touched == None:
+            return since
+        modified = datetime.datetime.fromtimestamp(touched, tz = datetime.timezone.utc)
+        return max(modified, since) if since != None else modified
+
+validators = Validators()
+
+def conditional(tags, parts = None, daily = False):
+    '''
+        Method decorator answering If-None-Match/If-Modified-Since with a 304 before the view runs, so an
+        unchanged response never touches the ORM or the serializers. Permissions are checked first.
+
+        @tags(request, *args, **kwargs) returns the cache tags the response is built from, None to skip validation
+        @parts(request, *args, **kwargs) returns anything else the response varies by, e.g. its query parameters
+        @daily marks responses that also change at midnight, e.g. what is open today
+    '''
+    def etag_func(request, *args, **kwargs):
+        response_tags = tags(request, *args, **kwargs)
+        if response_tags == None:
+            return None
+        response_parts = tuple(parts(request, *args, **kwargs)) if parts else ()
+        if daily:
+            response_parts += (datetime.date.today().isoformat(),)
+        return validators.etag(response_tags, *response_parts)
+
+    def last_modified_func(request, *args, **kwargs):
+        response_tags = tags(request, *args, **kwargs)
+        if response_tags == None:
+            return None
+        midnight = None
+        if daily:
+            midnight = timezone.make_aware(datetime.datetime.combine(datetime.date.today(), datetime.time.min))
+        return validators.last_modified(response_tags, midnight)
+
+    return method_decorator(condition(etag_func = etag_func, last_modified_func = last_modified_func))
+
+def query_params(*names):
+    '''
+        A @parts function of conditional returning the named query parameters
+    '''
+    def parts(request, *args, **kwargs):
+        return [request.GET.get(name) for name in names]
+    return parts
@@ -26,14 +26,8 @@ class CategoryService(ServiceBase):
 
     def is_appuser_admin(self, appuser_id, category_id):
         cache_key = f'is_appuser_admin?appuser_id={appuser_id}&category_id={category_id}'
-        result = self.cache.get(cache_key)
+        def load():
+            lst = list(Category.objects.select_related('restaurant').filter(restaurant__appuser_id = appuser_id).values('id'))
+            return int(category_id) in [item['id'] for item in lst]
 
-        if result != None:
-            return result
-
-        lst = list(Category.objects.select_related('restaurant').filter(restaurant__appuser_id = appuser_id).values('id'))
-        result = int(category_id) in [item['id'] for item in lst]
-
-        self.cache.set(cache_key, result)
-
-        return result
+        return self.cache.get_or_compute(cache_key, load)
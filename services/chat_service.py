@@ -1,7 +1,9 @@
+from django.conf import settings
 from django.db.models import Q
 
 from .base.service_base import ServiceBase
 from .appuser_service import AppUserService
+from .cache.chat_cache import ChatCache
 from utils.app_logger import get_logger
 from utils.hash import hash_string, validate_hash
 from domain.models import ChatRoom, ChatMessage
@@ -11,22 +13,33 @@ logger = get_logger(__name__)
 class ChatService(ServiceBase):
     def __init__(self):
         self._appuser_service = AppUserService()
-        pass
+        self.cache = ChatCache()
+
+    def __chatroom_key__(self, name):
+        return f'get_chatroom_by_name/?name={name}'
 
     def get_chatroom_by_name(self, name: str = '', include_messages: bool = False):      
         if not name:
             logger.warning(f'Invalid chatroom name')
             return None
-        try:
-            logger.info(f'Getting chatroom {name}')
-            if not include_messages:
-                chat_room = ChatRoom.objects.get(name = name)
-            else:
-                chat_room = ChatRoom.objects.prefetch_related('messages').get(name = name)
-            return chat_room
-        except ChatRoom.DoesNotExist:
-            logger.exception(f'Chatroom {name} not found')
-            return 
+
+        def load():
+            return ChatRoom.objects.filter(name = name).first()
+
+        chat_room = self.cache.get_or_compute(self.__chatroom_key__(name), load, settings.ONE_HOUR, negative_timeout = settings.NEGATIVE_CACHE_TIMEOUT)
+        if chat_room == None:
+            logger.info(f'Chatroom {name} not found')
+            return None
+
+        if include_messages:
+            chat_room = ChatRoom.objects.prefetch_related('messages').get(pk = chat_room.pk)
+        return chat_room
+
+    def clear_missing(self, name: str):
+        '''
+            Forgets that chatroom @name did not exist, called when it gets created
+        '''
+        self.cache.delete(self.__chatroom_key__(name))
 
     def create_chatroom(self, from_email: str = '', to_email: str = ''):
         if not from_email or not to_email:
@@ -34,8 +47,9 @@ class ChatService(ServiceBase):
             return None
 
         logger.error(f'Creating chatroom, between {from_email} and {to_email}')
-        creator = self._appuser_service.get(email = from_email, by = 'email')
-        other_user = self._appuser_service.get(email = to_email, by = 'email')
+        appusers = self._appuser_service.get_many_by_email([from_email, to_email])
+        creator = appusers.get(from_email)
+        other_user = appusers.get(to_email)
 
         from_to = f'{from_email}, {to_email}'
         chatroom_name = hash_string(from_to)
@@ -61,10 +75,12 @@ class ChatService(ServiceBase):
 
         chatroom = self.get_chatroom_by_name(chatroom_name)
 
+        appusers = self._appuser_service.get_many_by_email([from_email, to_email])
+
         chat_message = ChatMessage()
         chat_message.chat_room = chatroom
-        chat_message.sender = self._appuser_service.get(email = from_email, by = 'email')
-        chat_message.receiver = self._appuser_service.get(email = to_email, by = 'email')
+        chat_message.sender = appusers.get(from_email)
+        chat_message.receiver = appusers.get(to_email)
         chat_message.message = message
         chat_message.save()
 
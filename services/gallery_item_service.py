@@ -35,13 +35,7 @@ class GalleryItemService():
         return gallery_item
 
     def get_by_Restaurant_id(self, Restaurant_id):
-        gallery_items = self.cache.get(Restaurant_id)
+        def load():
+            return list(GalleryItem.objects.filter(Restaurant_id = Restaurant_id))
 
-        if gallery_items != None:
-            return gallery_items
-
-        gallery_items = list(GalleryItem.objects.filter(Restaurant_id = Restaurant_id))
-
-        self.cache.set(Restaurant_id, gallery_items)
-
-        return gallery_items
\ No newline at end of file
+        return self.cache.get_or_compute(f'gallery/?restaurant_id={Restaurant_id}', load)
\ No newline at end of file
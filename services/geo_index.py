@@ -0,0 +1,174 @@
+import math, time, threading
+
+from collections import defaultdict
+from django.conf import settings
+from domain.models import Restaurant, RestaurantOperatingHours
+from .cache.restaurants_cache import RestaurantsCache
+from .cache.tags import restaurants_tag
+
+EARTH_RADIUS = 6371008.8 #meters
+METERS_PER_DEGREE = 111320
+GEO_CHANGES_KEY = 'geo_changes'
+GEO_CHANGES_SIZE = 10000
+GEO_CHANGES_SLACK = 60 #seconds
+
+def haversine_many(lat, lng, lats, lngs):
+    '''
+        Great circle distances in meters from (lat, lng) to every point of the @lats/@lngs columns
+    '''
+    phi = math.radians(lat)
+    cos_phi = math.cos(phi)
+    radians, sin, cos, asin, sqrt = math.radians, math.sin, math.cos, math.asin, math.sqrt
+    distances = []
+    for other_lat, other_lng in zip(lats, lngs):
+        other_phi = radians(other_lat)
+        half_dphi = (other_phi - phi) / 2
+        half_dlambda = radians(other_lng - lng) / 2
+        a = sin(half_dphi) ** 2 + cos_phi * cos(other_phi) * sin(half_dlambda) ** 2
+        distances.append(2 * EARTH_RADIUS * asin(min(1.0, sqrt(a))))
+    return distances
+
+
+class GridIndex():
+    '''
+        Buckets points into square cells of @cell_size degrees. A radius query only visits
+        the cells overlapping the radius' bounding box and measures their points in one batch.
+    '''
+    def __init__(self, cell_size = 0.05):
+        self.cell_size = cell_size
+        self.cells = defaultdict(dict)
+        self.entries = {}
+        self.lock = threading.RLock()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __cell__(self, lat, lng):
+        return (math.floor(lat / self.cell_size), math.floor(lng / self.cell_size))
+
+    def upsert(self, id, lat, lng, days = frozenset()):
+        lat, lng = float(lat), float(lng)
+        with self.lock:
+            self.remove(id)
+            cell = self.__cell__(lat, lng)
+            self.cells[cell][id] = (lat, lng, frozenset(days))
+            self.entries[id] = cell
+
+    def remove(self, id):
+        with self.lock:
+            cell = self.entries.pop(id, None)
+            if cell == None:
+                return
+            points = self.cells[cell]
+            points.pop(id, None)
+            if not points:
+                del self.cells[cell]
+
+    def within(self, lat, lng, radius, day = None, after = None, limit = None):
+        '''
+            Returns [(distance, id)] of the points within @radius meters, closest first.
+            @day keeps only points open on that weekday, @after = (distance, id) seeks past a previous row.
+        '''
+        lat, lng = float(lat), float(lng)
+        lat_span = radius / METERS_PER_DEGREE
+        lng_span = radius / (METERS_PER_DEGREE * max(math.cos(math.radians(lat)), 0.01))
+        min_row, min_col = self.__cell__(lat - lat_span, lng - lng_span)
+        max_row, max_col = self.__cell__(lat + lat_span, lng + lng_span)
+
+        ids, lats, lngs = [], [], []
+        with self.lock:
+            for row in range(min_row, max_row + 1):
+                for col in range(min_col, max_col + 1):
+                    for id, (point_lat, point_lng, days) in self.cells.get((row, col), {}).items():
+                        if day != None and day not in days:
+                            continue
+                        ids.append(id)
+                        lats.append(point_lat)
+                        lngs.append(point_lng)
+
+        found = [(distance, id) for distance, id in zip(haversine_many(lat, lng, lats, lngs), ids) if distance <= radius]
+        if after != None:
+            after = tuple(after)
+            found = [f for f in found if f > after]
+
+        found.sort()
+        return found[:limit] if limit != None else found
+
+
+class RestaurantsGeoIndex():
+    '''
+        Per process GridIndex of the active restaurants and the weekdays they open.
+
+        Every committed restaurant or operating hours change records the restaurant id in a shared
+        collection (see changed) before bumping restaurants_tag(). When a process sees a new generation
+        of that tag it reloads only the ids changed since it last synced. It is rebuilt in full when first
+        used and every @max_age seconds.
+    '''
+    def __init__(self, cell_size, max_age):
+        self.cell_size = cell_size
+        self.max_age = max_age
+        self.cache = RestaurantsCache()
+        self.index = None
+        self.generation = None
+        self.synced_at = 0
+        self.built_at = 0
+        self.lock = threading.Lock()
+
+    def changed(self, restaurant_id):
+        '''
+            Records that a restaurant or its operating hours changed. Call it on commit, before bumping restaurants_tag()
+        '''
+        self.cache.add_or_update(GEO_CHANGES_KEY, restaurant_id, GEO_CHANGES_SIZE, self.max_age + GEO_CHANGES_SLACK)
+
+    def get(self):
+        # read before syncing: a bump landing mid sync leaves this index on the old generation
+        generation = self.cache.generations((restaurants_tag(),))[0]
+        if self.index == None or time.monotonic() - self.built_at > self.max_age:
+            with self.lock:
+                if self.index == None or time.monotonic() - self.built_at > self.max_age:
+                    synced_at = time.time()
+                    self.index = self.__build__()
+                    self.built_at = time.monotonic()
+                    self.generation, self.synced_at = generation, synced_at
+        elif self.generation != generation:
+            with self.lock:
+                if self.generation != generation:
+                    self.__sync__()
+                    self.generation = generation
+        return self.index
+
+    def __sync__(self):
+        synced_at = time.time()
+        # changes are scored by the writer's clock, the slack covers skew and writes racing this read
+        ids = [int(id) for id in self.cache.recent_since(GEO_CHANGES_KEY, self.synced_at - GEO_CHANGES_SLACK)]
+        if len(ids) >= GEO_CHANGES_SIZE:
+            # the collection was trimmed, changes may be missing
+            self.index = self.__build__()
+            self.built_at = time.monotonic()
+        elif ids:
+            self.__apply__(ids)
+        self.synced_at = synced_at
+
+    def __apply__(self, ids):
+        days = defaultdict(set)
+        for restaurant_id, day in RestaurantOperatingHours.objects.filter(restaurant_id__in = ids).values_list('restaurant_id', 'day'):
+            days[restaurant_id].add(day)
+
+        active = {id: (lat, lng) for id, lat, lng in Restaurant.objects.filter(id__in = ids, active = True).values_list('id', 'latitude', 'longitude')}
+        for id in ids:
+            if id in active:
+                self.index.upsert(id, active[id][0], active[id][1], days[id])
+            else:
+                self.index.remove(id)
+
+    def __build__(self):
+        index = GridIndex(self.cell_size)
+        days = defaultdict(set)
+        for restaurant_id, day in RestaurantOperatingHours.objects.filter(restaurant__active = True).values_list('restaurant_id', 'day'):
+            days[restaurant_id].add(day)
+
+        for id, lat, lng in Restaurant.objects.filter(active = True).values_list('id', 'latitude', 'longitude'):
+            index.upsert(id, lat, lng, days[id])
+        return index
+
+restaurants_geo_index = RestaurantsGeoIndex(settings.GEO_INDEX_CELL_SIZE, settings.GEO_INDEX_MAX_AGE)
@@ -31,3 +31,7 @@ class OK(Response):
 class FORBIDDEN(Response):
     def __init__(self):
         super(FORBIDDEN, self).__init__('Oh no, You can\'t touch this though!', status = status.HTTP_403_FORBIDDEN)
+
+class CONFLICT(Response):
+    def __init__(self, msg):
+        super(CONFLICT, self).__init__(msg, status = status.HTTP_409_CONFLICT)
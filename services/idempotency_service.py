@@ -0,0 +1,181 @@
+import datetime, functools, hashlib, json
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from rest_framework.response import Response
+from domain.models import IdempotencyKey
+from utils.app_logger import get_logger
+from .cache.idempotency_cache import IdempotencyCache
+from .http_response import BAD_REQUEST, CONFLICT
+
+logger = get_logger(__name__)
+
+IDEMPOTENCY_HEADER = 'HTTP_IDEMPOTENCY_KEY'
+REPLAYED_HEADER = 'Idempotent-Replayed'
+MAX_KEY_LENGTH = 255
+
+# What begin() found
+STARTED = 'started'
+REPLAY = 'replay'
+IN_PROGRESS = 'in_progress'
+MISMATCH = 'mismatch'
+
+PENDING = 'pending'
+DONE = 'done'
+
+class IdempotencyService():
+    '''
+        Runs a request at most once per (app user, Idempotency-Key). The key is reserved atomically in Redis
+        with cache.add; finished responses are kept in Redis and in the idempotency_keys table, which also
+        takes over the reservation whenever Redis is unavailable or has evicted the key.
+    '''
+    def __init__(self):
+        self.cache = IdempotencyCache()
+
+    def __cache_key__(self, appuser_id, key):
+        return f'idempotency/?appuser_id={appuser_id}&key={key}'
+
+    def fingerprint(self, scope, data, **kwargs):
+        raw = json.dumps([scope, data, kwargs], cls = DjangoJSONEncoder, sort_keys = True)
+        return hashlib.sha1(raw.encode()).hexdigest()
+
+    def begin(self, appuser_id, key, scope, fingerprint):
+        '''
+            Reserves @key for a request. Returns (STARTED, None) when the caller should run it,
+            (REPLAY, (status, data)) when it already ran, IN_PROGRESS or MISMATCH otherwise
+        '''
+        cache_key = self.__cache_key__(appuser_id, key)
+        try:
+            if self.cache.add(cache_key, {'state': PENDING, 'fingerprint': fingerprint}, settings.IDEMPOTENCY_LOCK_TIMEOUT):
+                # redis may have evicted or never seen a key the database knows
+                return self.__begin_from_db__(appuser_id, key, scope, fingerprint, reserve = False)
+            entry = self.cache.get(cache_key)
+        except Exception:
+            logger.exception('Idempotency cache unavailable, reserving in the database')
+            return self.__begin_from_db__(appuser_id, key, scope, fingerprint, reserve = True)
+
+        if entry == None:
+            # expired between add and get, let the retry decide
+            return IN_PROGRESS, None
+        return self.__state__(entry, fingerprint)
+
+    def __state__(self, entry, fingerprint):
+        if entry['fingerprint'] != fingerprint:
+            return MISMATCH, None
+        if entry['state'] == DONE:
+            return REPLAY, (entry['status'], entry['data'])
+        return IN_PROGRESS, None
+
+    def __begin_from_db__(self, appuser_id, key, scope, fingerprint, reserve):
+        now = timezone.now()
+        since = now - datetime.timedelta(seconds = settings.IDEMPOTENCY_KEY_TIMEOUT)
+        stored = IdempotencyKey.objects.filter(appuser_id = appuser_id, key = key, created_on__gte = since).first()
+
+        if stored != None:
+            if stored.status_code == None:
+                if stored.fingerprint == fingerprint and stored.created_on < now - datetime.timedelta(seconds = settings.IDEMPOTENCY_LOCK_TIMEOUT):
+                    return self.__take_over__(stored, now)
+                entry = {'state': PENDING, 'fingerprint': stored.fingerprint}
+            else:
+                entry = {'state': DONE, 'fingerprint': stored.fingerprint, 'status': stored.status_code, 'data': stored.response}
+                self.__cache_result__(appuser_id, key, entry)
+            return self.__state__(entry, fingerprint)
+
+        if reserve:
+            try:
+                with transaction.atomic():
+                    IdempotencyKey.objects.filter(appuser_id = appuser_id, key = key, created_on__lt = since).delete()
+                    IdempotencyKey.objects.create(appuser_id = appuser_id, key = key, scope = scope, fingerprint = fingerprint)
+            except IntegrityError:
+                return IN_PROGRESS, None
+
+        return STARTED, None
+
+    def __take_over__(self, stored, now):
+        '''
+            Reserves a pending row whose request died without completing or releasing it. Matching on created_on
+            lets exactly one of several concurrent retries win
+        '''
+        taken = IdempotencyKey.objects.filter(pk = stored.pk, status_code = None, created_on = stored.created_on).update(created_on = now)
+        return (STARTED, None) if taken else (IN_PROGRESS, None)
+
+    def complete(self, appuser_id, key, scope, fingerprint, status, data):
+        '''
+            Stores the response of a request that ran, so that retries replay it
+        '''
+        entry = {'state': DONE, 'fingerprint': fingerprint, 'status': status, 'data': data}
+        self.__cache_result__(appuser_id, key, entry)
+        try:
+            IdempotencyKey.objects.update_or_create(appuser_id = appuser_id, key = key, defaults = {
+                'scope': scope,
+                'fingerprint': fingerprint,
+                'status_code': status,
+                'response': data,
+                'created_on': timezone.now()
+            })
+        except Exception:
+            logger.exception(f'Could not store the response of idempotency key {key}')
+
+    def release(self, appuser_id, key):
+        '''
+            Frees the key of a request that failed, so that a retry runs it again
+        '''
+        try:
+            self.cache.delete(self.__cache_key__(appuser_id, key))
+        except Exception:
+            logger.exception(f'Could not release idempotency key {key}')
+        IdempotencyKey.objects.filter(appuser_id = appuser_id, key = key, status_code = None).delete()
+
+    def __cache_result__(self, appuser_id, key, entry):
+        try:
+            self.cache.set(self.__cache_key__(appuser_id, key), entry, settings.IDEMPOTENCY_KEY_TIMEOUT)
+        except Exception:
+            logger.exception(f'Could not cache the response of idempotency key {key}')
+
+
+def idempotent(scope):
+    '''
+        View method decorator honouring the Idempotency-Key header: a retry of a finished request gets the stored
+        response without running the view, a retry of a running one gets 409 and a key reused for another
+        request gets 400. Responses under 500 are stored, server errors release the key. Needs request.appuser_id,
+        so it runs after the permission checks
+    '''
+    service = IdempotencyService()
+
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(self, request, *args, **kwargs):
+            key = request.META.get(IDEMPOTENCY_HEADER)
+            if not key:
+                return view(self, request, *args, **kwargs)
+            if len(key) > MAX_KEY_LENGTH:
+                return BAD_REQUEST({'Idempotency-Key': f'Must be at most {MAX_KEY_LENGTH} characters.'})
+
+            appuser_id = request.appuser_id
+            fingerprint = service.fingerprint(scope, request.data, **kwargs)
+            state, stored = service.begin(appuser_id, key, scope, fingerprint)
+
+            if state == REPLAY:
+                response = Response(stored[1], status = stored[0])
+                response[REPLAYED_HEADER] = 'true'
+                return response
+            if state == IN_PROGRESS:
+                return CONFLICT('A request with this Idempotency-Key is still being processed.')
+            if state == MISMATCH:
+                return BAD_REQUEST({'Idempotency-Key': 'Already used for a different request.'})
+
+            try:
+                response = view(self, request, *args, **kwargs)
+            except Exception:
+                service.release(appuser_id, key)
+                raise
+
+            if response.status_code >= 500:
+                service.release(appuser_id, key)
+            else:
+                service.complete(appuser_id, key, scope, fingerprint, response.status_code, getattr(response, 'data', None))
+            return response
+        return wrapper
+    return decorator
@@ -0,0 +1,158 @@
+import csv, io, json
+
+from django.db import transaction
+from domain.models import RestaurantMenuItemCategory, RestaurantMenuItem, OptionCategory, Option, RestaurantMenuItemOption, Restaurant
+from domain.serializers import MenuImportSerializer
+from domain.utils import get_unique_slugs
+from utils.app_logger import get_logger
+from .cache.restaurants_cache import RestaurantsCache
+from .cache.tags import restaurant_tag
+from .menu_service import MenuService
+
+logger = get_logger(__name__)
+
+FORMAT_JSON = 'json'
+FORMAT_CSV = 'csv'
+CSV_LIST_SEPARATOR = '|'
+
+class MenuImportError(Exception):
+    '''
+        Raised with serializer style errors when an import is invalid
+    '''
+    def __init__(self, errors):
+        super(MenuImportError, self).__init__(errors)
+        self.errors = errors
+
+class MenuImportService():
+    '''
+        Imports a whole menu in one transaction: categories, menu items, option categories and options are
+        inserted with bulk_create and the restaurant's caches are invalidated and rebuilt once at the end.
+        Existing categories and option categories are matched by name and heading and reused.
+    '''
+    def __init__(self):
+        self._menu = MenuService()
+
+    def parse(self, content, format = FORMAT_JSON):
+        '''
+            Parses an import file. JSON is the MenuImportSerializer shape. CSV has a row per menu item with the
+            columns category, name, price, active (optional) and option_categories (optional, | separated headings
+            of option categories that already exist)
+        '''
+        if isinstance(content, bytes):
+            content = content.decode('utf-8-sig')
+
+        if format == FORMAT_JSON:
+            try:
+                return json.loads(content)
+            except ValueError as e:
+                raise MenuImportError({'file': f'Invalid JSON: {e}'})
+
+        if format != FORMAT_CSV:
+            raise MenuImportError({'format': f'Unsupported format {format}.'})
+
+        categories = {}
+        for row in csv.DictReader(io.StringIO(content)):
+            item = {
+                'name': (row.get('name') or '').strip(),
+                'price': (row.get('price') or '').strip(),
+                'option_categories': [heading.strip() for heading in (row.get('option_categories') or '').split(CSV_LIST_SEPARATOR) if heading.strip()]
+            }
+            if (row.get('active') or '').strip():
+                item['active'] = row['active'].strip()
+            categories.setdefault((row.get('category') or '').strip(), []).append(item)
+
+        return {'categories': [{'name': name, 'items': items} for name, items in categories.items()]}
+
+    def validate(self, data):
+        serializer = MenuImportSerializer(data = data)
+        if not serializer.is_valid():
+            raise MenuImportError(serializer.errors)
+        return serializer.validated_data
+
+    def import_menu(self, restaurant_id, data):
+        '''
+            Validates @data and imports it into restaurant @restaurant_id. Returns the number of rows created per model
+        '''
+        menu = self.validate(data)
+
+        with transaction.atomic():
+            categories, created_categories = self.__categories__(restaurant_id, menu['categories'])
+            option_categories, created_option_categories, created_options = self.__option_categories__(restaurant_id, menu.get('option_categories', []))
+
+            missing = sorted(set(heading for category in menu['categories'] for item in category['items']
+                                         for heading in item.get('option_categories', [])) - set(option_categories))
+            if missing:
+                raise MenuImportError({'option_categories': f'Unknown option categories: {", ".join(missing)}.'})
+
+            items = []
+            item_headings = []
+            for category in menu['categories']:
+                for item in category['items']:
+                    items.append(RestaurantMenuItem(category_id = categories[category['name']], name = item['name'],
+                                                    price = item['price'], active = item['active']))
+                    item_headings.append(item.get('option_categories', []))
+            self.__assign_slugs__(items)
+            RestaurantMenuItem.objects.bulk_create(items)
+
+            item_options = [RestaurantMenuItemOption(restaurant_id = restaurant_id, menu_item_id = item.id, option_category_id = option_categories[heading])
+                            for item, headings in zip(items, item_headings) for heading in headings]
+            RestaurantMenuItemOption.objects.bulk_create(item_options)
+
+            transaction.on_commit(lambda: self.__rebuild_caches__(restaurant_id))
+
+        return {
+            'categories': created_categories,
+            'menu_items': len(items),
+            'option_categories': created_option_categories,
+            'options': created_options,
+            'menu_item_options': len(item_options)
+        }
+
+    def __categories__(self, restaurant_id, categories):
+        '''
+            Returns ({name: id} of the restaurant's categories, how many were created)
+        '''
+        existing = dict(RestaurantMenuItemCategory.objects \
+                            .filter(restaurant_id = restaurant_id, name__in = [category['name'] for category in categories]) \
+                            .values_list('name', 'id'))
+        new = [RestaurantMenuItemCategory(restaurant_id = restaurant_id, name = category['name'])
+               for category in categories if category['name'] not in existing]
+        self.__assign_slugs__(new)
+        RestaurantMenuItemCategory.objects.bulk_create(new)
+        existing.update((category.name, category.id) for category in new)
+        return existing, len(new)
+
+    def __option_categories__(self, restaurant_id, option_categories):
+        '''
+            Returns ({heading: id} of the restaurant's option categories, option categories created, options created)
+        '''
+        existing = {}
+        for id, heading in OptionCategory.objects.filter(restaurant_id = restaurant_id).order_by('id').values_list('id', 'heading'):
+            existing.setdefault(heading, id)
+
+        new = [option_category for option_category in option_categories if option_category['heading'] not in existing]
+        created = [OptionCategory(restaurant_id = restaurant_id, heading = option_category['heading'], mandatory = option_category['mandatory'],
+                                  multiple_choice = option_category['multiple_choice'], num_choose = option_category['num_choose'])
+                   for option_category in new]
+        OptionCategory.objects.bulk_create(created)
+        existing.update((option_category.heading, option_category.id) for option_category in created)
+
+        options = [Option(category_id = existing[option_category['heading']], name = option['name'], price = option['price'])
+                   for option_category in option_categories for option in option_category.get('options', [])]
+        Option.objects.bulk_create(options)
+
+        return existing, len(created), len(options)
+
+    def __assign_slugs__(self, instances):
+        for instance, slug in zip(instances, get_unique_slugs(instances, 'name', 'slug')):
+            instance.slug = slug
+
+    def __rebuild_caches__(self, restaurant_id):
+        RestaurantsCache().bump(restaurant_tag(restaurant_id))
+        try:
+            slug = Restaurant.objects.filter(pk = restaurant_id).values_list('slug', flat = True).first()
+            self._menu.get_menu_document(slug)
+            self._menu.get_all_options(slug)
+            self._menu.get_price_index(restaurant_id)
+        except Exception:
+            logger.exception(f'Could not rebuild the menu caches of restaurant {restaurant_id}')
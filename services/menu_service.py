@@ -1,11 +1,42 @@
+import hashlib, json
+
+from collections import namedtuple
 from django.db.models import Q, Prefetch
+from django.core.serializers.json import DjangoJSONEncoder
+from django.conf import settings
 from .base.service_base import ServiceBase
-from domain.models import RestaurantMenuItemCategory, MenuItem, OptionCategory, RestaurantMenuItemOption, RestaurantMenuItem
+from domain.models import RestaurantMenuItemCategory, MenuItem, OptionCategory, RestaurantMenuItemOption, RestaurantMenuItem, Option
 from .cache.menu_cache import MenuCache
+from .cache.tags import restaurant_tag
+from .cache.base.codec import RowsCodec
+from .restaurants import RestaurantsService
+from domain.serializers import RestaurantCategoryResponseSerializer, MenuItemOptionResponseSerializer, RestaurantOptionCategoryResponseSerializer
+
+OPTIONS_CODEC = RowsCodec('options:1')
+ALL_OPTIONS_CODEC = RowsCodec('all_options:1')
+
+# A restaurant's menu rendered once to JSON, with the sha1 of the body as its ETag
+MenuDocument = namedtuple('MenuDocument', ('body', 'etag'))
+
+def render_document(rows):
+    body = json.dumps(rows, cls = DjangoJSONEncoder, separators = (',', ':')).encode()
+    return MenuDocument(body, hashlib.sha1(body).hexdigest())
+
+EMPTY_MENU = render_document([])
 
 class MenuService(ServiceBase):
     def __init__(self):
         self.cache = MenuCache()
+        self._restaurants = RestaurantsService()
+
+    def __restaurant_tags__(self, slug):
+        '''
+            The cache tags of a restaurant by slug, None if there is no such restaurant
+        '''
+        restaurant_id = self._restaurants.get_id_by_slug(slug)
+        if restaurant_id == None:
+            return None
+        return (restaurant_tag(restaurant_id),)
 
     def get_queryset(self):
         return OptionCategory.objects.all
@@ -17,39 +48,102 @@ class MenuService(ServiceBase):
         except MenuItem.DoesNotExist:
             return None
 
-    def get_menu(self, name):
-        cache_key = f'get_menu/?name={name}'
-        menu = self.cache.get(cache_key)
-        if menu != None:
-            return menu
+    def get_menu_document(self, name):
+        '''
+            Returns the MenuDocument of a restaurant. It is rebuilt whenever one of the restaurant's categories,
+            menu items or options changes, a cache hit never touches the ORM or the serializers
+        '''
+        cache_key = f'get_menu_document/?name={name}'
+        tags = self.__restaurant_tags__(name)
+        if tags == None:
+            return EMPTY_MENU
 
-        q = Q()
-        q &= Q(restaurant__slug = name)
-        menu = list(RestaurantMenuItemCategory.objects \
-                        .prefetch_related(Prefetch('menu_items')) \
-                        .filter(restaurant__slug = name).all())
+        def load():
+            menu = RestaurantMenuItemCategory.objects \
+                            .prefetch_related(Prefetch('menu_items')) \
+                            .filter(restaurant__slug = name).all()
+            return render_document(RestaurantCategoryResponseSerializer(menu, many = True).data)
 
-        self.cache.set(cache_key, menu, 60)
-        return menu
+        return self.cache.get_or_compute(cache_key, load, settings.ENTITY_CACHE_TIMEOUT, tags = tags, stale_timeout = settings.ENTITY_CACHE_STALE_AFTER)
 
     def get_options(self, restaurant, menu_item):
+        '''
+            Returns the serialized option categories, with their options, of a menu item
+        '''
         cache_key = f'get_options/?restaurant={restaurant}&menu_item={menu_item}'
-
-        options = self.cache.get(cache_key, None)
-        if options != None:
+        tags = self.__restaurant_tags__(restaurant)
+        if tags == None:
+            return []
+
+        def load():
+            q = Q()
+            q &= Q(menu_item__slug = menu_item)
+            q &= Q(restaurant__slug = restaurant)
+            q &= Q(option_category__active = True)
+            options = RestaurantMenuItemOption.objects\
+                            .prefetch_related('option_category__options')\
+                            .select_related('menu_item', 'option_category', 'restaurant')\
+                            .filter(q)
+            return MenuItemOptionResponseSerializer(options, many = True).data
+
+        return self.cache.get_or_compute(cache_key, load, settings.ENTITY_CACHE_TIMEOUT, tags = tags, codec = OPTIONS_CODEC, stale_timeout = settings.ENTITY_CACHE_STALE_AFTER)
+
+    def get_options_many(self, restaurant, menu_items):
+        '''
+            get_options for several menu items of a restaurant: one cache round trip and at most one query.
+            Returns {menu_item: options}
+        '''
+        tags = self.__restaurant_tags__(restaurant)
+        if tags == None:
+            return {menu_item: [] for menu_item in menu_items}
+        keys = {self.cache.tagged_key(f'get_options/?restaurant={restaurant}&menu_item={menu_item}', tags): menu_item for menu_item in menu_items}
+
+        def load(missing):
+            q = Q()
+            q &= Q(menu_item__slug__in = [keys[key] for key in missing])
+            q &= Q(restaurant__slug = restaurant)
+            q &= Q(option_category__active = True)
+            options = {key: [] for key in missing}
+            by_slug = {keys[key]: key for key in missing}
+            for option in RestaurantMenuItemOption.objects\
+                            .prefetch_related('option_category__options')\
+                            .select_related('menu_item', 'option_category', 'restaurant')\
+                            .filter(q):
+                options[by_slug[option.menu_item.slug]].append(MenuItemOptionResponseSerializer(option).data)
             return options
 
-        q = Q()
-        q &= Q(menu_item__slug = menu_item)
-        q &= Q(restaurant__slug = restaurant)
-        q &= Q(option_category__active = True)
-        options = list(RestaurantMenuItemOption.objects\
-                        .prefetch_related('option_category__options')\
-                        .select_related('menu_item', 'option_category', 'restaurant')\
-                        .filter(q))
-
-        self.cache.set(cache_key, options)
-        return options
+        result = self.cache.get_or_compute_many(list(keys), load, settings.ENTITY_CACHE_TIMEOUT, codec = OPTIONS_CODEC)
+        return {keys[key]: options for key, options in result.items()}
+
+    def get_all_options(self, restaurant):
+        '''
+            Returns the options of every menu item of a restaurant:
+            {option_categories: [active option categories, each once, with their options], menu_items: {menu item slug: [option category ids]}}
+        '''
+        cache_key = f'get_all_options/?restaurant={restaurant}'
+        tags = self.__restaurant_tags__(restaurant)
+        if tags == None:
+            return {'option_categories': [], 'menu_items': {}}
+
+        def load():
+            q = Q()
+            q &= Q(restaurant__slug = restaurant)
+            q &= Q(option_category__active = True)
+            categories = {}
+            menu_items = {}
+            for item_option in RestaurantMenuItemOption.objects\
+                            .prefetch_related('option_category__options')\
+                            .select_related('menu_item', 'option_category')\
+                            .filter(q)\
+                            .order_by('option_category_id'):
+                categories.setdefault(item_option.option_category_id, item_option.option_category)
+                menu_items.setdefault(item_option.menu_item.slug, []).append(item_option.option_category_id)
+            return {
+                'option_categories': RestaurantOptionCategoryResponseSerializer(list(categories.values()), many = True).data,
+                'menu_items': menu_items
+            }
+
+        return self.cache.get_or_compute(cache_key, load, settings.ENTITY_CACHE_TIMEOUT, tags = tags, codec = ALL_OPTIONS_CODEC, stale_timeout = settings.ENTITY_CACHE_STALE_AFTER)
 
     def create_menu_item(Self, **kwargs):
         try:
@@ -82,15 +176,20 @@ class MenuService(ServiceBase):
         category.save()
         return category
 
-    def get_menu_items_by_restaurant(self, restaurant_id):
-        cache_key = f'get_menu_items_by_restaurant?restaurant_id={restaurant_id}'
-        menu_items = self.cache.get(cache_key)
-
-        if menu_items != None:
-            return menu_items
-
-        menu_items = list(RestaurantMenuItem.objects.select_related('category').filter(category__restaurant_id = restaurant_id))
-
-        self.cache.set(cache_key, menu_items)
-
-        return menu_items
+    def get_price_index(self, restaurant_id):
+        '''
+            Returns the prices of a restaurant's active menu items and options: {items: {id: price}, options: {id: price}}
+        '''
+        cache_key = f'get_price_index/?restaurant_id={restaurant_id}'
+
+        def load():
+            return {
+                'items': dict(RestaurantMenuItem.objects \
+                                .filter(category__restaurant_id = restaurant_id, active = True) \
+                                .values_list('id', 'price')),
+                'options': dict(Option.objects \
+                                .filter(category__restaurant_id = restaurant_id, category__active = True) \
+                                .values_list('id', 'price'))
+            }
+
+        return self.cache.get_or_compute(cache_key, load, settings.ENTITY_CACHE_TIMEOUT, tags = (restaurant_tag(restaurant_id),))
@@ -1,8 +1,17 @@
 from django.db.models import Q
+from django.conf import settings
 
+from utils.app_logger import get_logger
 from .base.service_base import ServiceBase
 from .cache.option_categories_cache import OptionCategoriesCache
+from .cache.tags import restaurant_tag
+from .cache.base.codec import RowsCodec
 from domain.models import OptionCategory
+from domain.serializers import OptionCategoryListSerializer
+
+logger = get_logger(__name__)
+
+OPTION_CATEGORIES_CODEC = RowsCodec('option_categories:1')
 
 class OptionCategoryService(ServiceBase):
     def __init__(self):
@@ -29,16 +38,13 @@ class OptionCategoryService(ServiceBase):
     def get_by_restaurant(self, restaurant):
         cache_key = f'get_by_restaurant/?restaurant={restaurant}'
 
-        option_categories = self.cache.get(cache_key, None)
-        if option_categories != None:
-            return option_categories
-
-        q = Q()
-        q &= Q(restaurant_id = restaurant)
-        option_categories = list(OptionCategory.objects.prefetch_related('options').filter(q))
+        def load():
+            q = Q()
+            q &= Q(restaurant_id = restaurant)
+            option_categories = OptionCategory.objects.prefetch_related('options').filter(q)
+            return OptionCategoryListSerializer(option_categories, many = True).data
 
-        self.cache.set(cache_key, option_categories)
-        return option_categories
+        return self.cache.get_or_compute(cache_key, load, settings.ENTITY_CACHE_TIMEOUT, tags = (restaurant_tag(restaurant),), codec = OPTION_CATEGORIES_CODEC, stale_timeout = settings.ENTITY_CACHE_STALE_AFTER)
 
     def update(self, id, **kwargs):
         option_category = self.get(id)
@@ -54,21 +60,16 @@ class OptionCategoryService(ServiceBase):
 
     def is_appuser_admin(self, appuser_id, id):
         cache_key = f'is_appuser_admin/?appuser_id={appuser_id}&id={id}'
-        is_admin = self.cache.get(cache_key)
+        def load():
+            q = Q()
+            q &= Q(id = id)
+            q &= Q(restaurant__appuser_id = appuser_id)
+            return OptionCategory.objects.filter(q).exists()
 
-        if is_admin != None:
-            return is_admin
-
-        q = Q()
-        q &= Q(id = id)
-        q &= Q(restaurant__appuser_id = appuser_id)
+        # a failed lookup denies access without caching the denial
         try:
-            is_admin = OptionCategory.objects.select_related('restaurant').filter(q).exists()
-        except Exception as e:
-            print(e)
-            is_admin = False
-        
-        self.cache.set(cache_key, is_admin)
-
-        return is_admin
+            return self.cache.get_or_compute(cache_key, load)
+        except Exception:
+            logger.exception(f'Could not check whether appuser {appuser_id} administers option category {id}')
+            return False
         
\ No newline at end of file
@@ -0,0 +1,67 @@
+import json
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.core.serializers.json import DjangoJSONEncoder
+from domain.models import Order
+from domain.serializers import OrderResponseSerializer
+from domain.constants import ORDER_CANCELLED_STATUS
+from utils.app_logger import get_logger
+from .order_service import OrderService
+
+logger = get_logger(__name__)
+
+ORDER_CREATED = 'created'
+ORDER_UPDATED = 'updated'
+ORDER_CANCELLED = 'cancelled'
+ORDER_SNAPSHOT = 'snapshot'
+
+def orders_group(restaurant_id):
+    return f'orders_{restaurant_id}'
+
+def order_message(event, order):
+    '''
+        The channel layer message a restaurant's OrdersConsumer group receives for @event on serialized @order
+    '''
+    return {'type': 'order.event', 'event': event, 'order': order}
+
+class OrderFeedService():
+    '''
+        Pushes orders to the websockets of their restaurant's admins, see merchants.consumers.OrdersConsumer
+    '''
+    def __init__(self):
+        self._order_service = OrderService()
+
+    def __serialize__(self, orders, many = False):
+        # the channel layer only carries plain types, no decimals or datetimes
+        return json.loads(json.dumps(OrderResponseSerializer(orders, many = many).data, cls = DjangoJSONEncoder))
+
+    def pending(self, restaurant_id):
+        '''
+            Today's pending orders of a restaurant, serialized, sent when a websocket connects
+        '''
+        return self.__serialize__(self._order_service.get_todays_pending_orders(restaurant_id), many = True)
+
+    def event(self, order, created):
+        if created:
+            return ORDER_CREATED
+        if order.status == ORDER_CANCELLED_STATUS:
+            return ORDER_CANCELLED
+        return ORDER_UPDATED
+
+    def publish(self, order_id, event):
+        '''
+            Sends order @order_id to its restaurant's group. Called once the transaction that wrote it committed
+        '''
+        order = Order.objects \
+                    .prefetch_related('line_items__menu_item') \
+                    .select_related('appuser__user', 'restaurant') \
+                    .filter(pk = order_id) \
+                    .first()
+        if order == None:
+            return
+
+        try:
+            async_to_sync(get_channel_layer().group_send)(orders_group(order.restaurant_id), order_message(event, self.__serialize__(order)))
+        except Exception:
+            logger.exception(f'Could not publish order {order_id}')
@@ -1,7 +1,8 @@
 import datetime
 
 from domain.models import Order, OrderLineItem
-from domain.constants import ORDER_ACCEPTED_STATUS, CANNOT_CHANGE_ORDER_MSG, ORDER_CANCELLED_STATUS, ORDER_CANCELLED_BY_CUSTOMER
+from domain.constants import ORDER_ACCEPTED_STATUS, CANNOT_CHANGE_ORDER_MSG, ORDER_CANCELLED_STATUS, ORDER_CANCELLED_BY_CUSTOMER, \
+                             ORDER_RESTAURANT_MISMATCH_MSG
 from .base.service_base import ServiceBase
 from .menu_service import MenuService
 from django.db.transaction import atomic
@@ -13,22 +14,34 @@ class OrderService(ServiceBase):
         self._menu = MenuService()
 
     def validate(self, **kwargs):
-        menu_items = self._menu.get_menu_items_by_restaurant(kwargs.get('restaurant').id)
-        if not menu_items:
+        '''
+            An order is valid when every line item and extra is an active menu item or option of its restaurant
+        '''
+        prices = self._menu.get_price_index(kwargs.get('restaurant').id)
+        if not prices['items']:
             return False
 
-        is_valid = set(detail['menu_item'].id for detail in kwargs.get('line_items')).issubset(menu_item.id for menu_item in menu_items)
+        items_valid = all(detail['menu_item_id'] in prices['items'] and detail['quantity'] > 0 for detail in kwargs.get('line_items'))
+        extras_valid = all(extra['id'] in prices['options'] for extra in kwargs.get('extras') or [])
+
+        return items_valid and extras_valid
 
-        return is_valid
-        
     def create(self, appuser_id, **kwargs):
+        '''
+            Places an order. The line items are priced from the restaurant's price index and the total is known
+            before anything is written, so the order is one INSERT and its line items another
+        '''
+        restaurant = kwargs.get('restaurant')
+        prices = self._menu.get_price_index(restaurant.id)
+        line_items = self.__build_order_line_items__(kwargs.get('line_items'), None, prices)
+
         with atomic():
-            order = Order()
-            order.restaurant = kwargs.get('restaurant')
-            order.appuser_id = appuser_id
-            order.note = kwargs.get('note')
-            order.save()
-            self.__save_order_line_items__(order, kwargs.get('line_items'))
+            order = Order.objects.create(restaurant = restaurant,
+                                         appuser_id = appuser_id,
+                                         note = kwargs.get('note'),
+                                         total = sum(line_item.sub_total for line_item in line_items))
+            self.__save_order_line_items__(order, line_items)
+        return order
 
     def get(self, id: int):
         try:
@@ -87,11 +100,20 @@ class OrderService(ServiceBase):
         if order.status == ORDER_ACCEPTED_STATUS:
             return False, CANNOT_CHANGE_ORDER_MSG
 
+        # the payload was validated against its own restaurant, the line items are priced from the order's
+        if kwargs.get('restaurant').id != order.restaurant_id:
+            return False, ORDER_RESTAURANT_MISMATCH_MSG
+
+        prices = self._menu.get_price_index(order.restaurant_id)
+        line_items = self.__build_order_line_items__(kwargs.get('line_items'), order, prices)
+
         with atomic():
             order.note = kwargs.get('note')
-            order.line_items.all()._raw_delete(order.line_items.db)
+            order.total = sum(line_item.sub_total for line_item in line_items)
             order.last_updated = datetime.datetime.now()
-            self.__save_order_OrderLineItems__(order, kwargs.get('line_items'))
+            order.save(update_fields = ('note', 'total', 'last_updated'))
+            order.line_items.all()._raw_delete(order.line_items.db)
+            self.__save_order_line_items__(order, line_items)
             return True, ''
 
     def accept_order(self, order_id):
@@ -116,18 +138,18 @@ class OrderService(ServiceBase):
 
         return restaurant_id_result[0]['restaurant_id' if restaurant_id_result else None]
 
-    def __build_order_line_items__(self, items, order):
+    def __build_order_line_items__(self, items, order, prices):
         line_items = []
         for item in items:
+            price = prices['items'][item['menu_item_id']]
             item['order'] = order
-            item['unit_price'] = item['menu_item'].price
-            item['sub_total'] = item['quantity'] * item['menu_item'].price
+            item['unit_price'] = price
+            item['sub_total'] = item['quantity'] * price
             detail = OrderLineItem(**item)
             line_items.append(detail)
         return line_items
 
     def __save_order_line_items__(self, order, line_items):
-        line_items = self.__build_order_line_items__(line_items, order)
-        OrderLineItem.objects.bulk_create(line_items)
-        order.total = sum([d.sub_total for d in line_items])
-        order.save()
\ No newline at end of file
+        for line_item in line_items:
+            line_item.order = order
+        OrderLineItem.objects.bulk_create(line_items)
\ No newline at end of file
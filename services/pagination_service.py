@@ -1,28 +1,50 @@
+import datetime, decimal
+
 from django.core.paginator import Paginator, PageNotAnInteger
 from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from .signing_service import sign, unsign
 
 PAGE_SIZE = 10
+NEXT = 'n'
+PREVIOUS = 'p'
 
 class Pager():
-    def __init__(self, items, page_number = 1, page_size = PAGE_SIZE):
+    def __init__(self, items, page_number = 1, page_size = PAGE_SIZE, cursor = None):
+        '''
+            @cursor opts into keyset pagination. Pass '' for the first page and the
+            next_cursor/prev_cursor of a previous PagedCollection for the others.
+        '''
         self.items = items
         self.page_number = int(page_number if page_number else 1)
         if not page_size or int(page_size) not in [10, 15, 20]:
             self.page_size = PAGE_SIZE
-        else: 
+        else:
             self.page_size = int(page_size)
+        self.keyset = cursor is not None
+        self.cursor = cursor
 
 
 class PagedCollection():
-    def __init__(self, total_pages = 0, page_size = 0, page_number = 0, total_count = 0, next_page = None, data = []):
+    def __init__(self, total_pages = 0, page_size = 0, page_number = 0, total_count = 0, next_page = None, data = [], keyset = False, next_cursor = None, prev_cursor = None):
         self.total_pages = total_pages
         self.page_size = page_size
         self.page_number = page_number
         self.total_count = total_count
         self.next_page = next_page
         self.data = data
+        self.keyset = keyset
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
 
     def __iter__(self):
+        if self.keyset:
+            yield 'page_size', self.page_size
+            yield 'next_cursor', self.next_cursor
+            yield 'prev_cursor', self.prev_cursor
+            yield 'data', self.data
+            return
+
         yield 'total_pages', self.total_pages
         yield 'page_number', self.page_number
         yield 'total_count', self.total_count
@@ -30,13 +52,55 @@ class PagedCollection():
         yield 'data', self.data
 
     def serialize_data(self, serializer):
-        self.data = serializer(self.data, many = True).data
-        return dict(self)
-        
+        '''
+            Returns the collection as a dict with its data serialized, leaving the collection itself untouched
+        '''
+        result = dict(self)
+        result['data'] = serializer(self.data, many = True).data
+        return result
+
+
+def __encode_value__(value):
+    if isinstance(value, datetime.datetime):
+        return ['dt', value.isoformat()]
+    if isinstance(value, decimal.Decimal):
+        return ['dec', str(value)]
+    return value
+
+def __decode_value__(value):
+    if isinstance(value, list):
+        kind, raw = value
+        if kind == 'dt':
+            return parse_datetime(raw)
+        if kind == 'dec':
+            return decimal.Decimal(raw)
+    return value
+
+def encode_cursor(values, direction = NEXT):
+    '''
+        Signs the key values of a row into an opaque cursor token
+    '''
+    return sign({'d': direction, 'v': [__encode_value__(v) for v in values]})
+
+def decode_cursor(token):
+    '''
+        Returns (values, direction) for a cursor token, or (None, NEXT) if it is empty or was tampered with
+    '''
+    if not token:
+        return None, NEXT
+    try:
+        payload = unsign(token)
+        return [__decode_value__(v) for v in payload['v']], payload['d']
+    except Exception:
+        return None, NEXT
+
 
 class PaginationService():
 
     def paginate(self, pager: Pager, filter: Q):
+        if pager.keyset:
+            return self.paginate_keyset(pager, filter)
+
         paginator = Paginator(pager.items.filter(filter) if filter else pager.items, pager.page_size)
         if paginator.count == 0:
             return PagedCollection()
@@ -46,3 +110,61 @@ class PaginationService():
 
         paged_collection = PagedCollection(paginator.num_pages, pager.page_size, pager.page_number, paginator.count, next_page, data)
         return paged_collection
+
+    def paginate_keyset(self, pager: Pager, filter: Q):
+        '''
+            Seeks past the cursor row on the queryset's ordering instead of counting and offsetting.
+            The primary key is appended to the ordering as a tie breaker when it is not already part of it.
+        '''
+        items = pager.items.filter(filter) if filter else pager.items
+        ordering = self.__keyset_ordering__(items)
+        values, direction = decode_cursor(pager.cursor)
+
+        if direction == PREVIOUS:
+            ordering = [self.__reverse__(field) for field in ordering]
+
+        if values != None and len(values) == len(ordering):
+            items = items.filter(self.__seek__(ordering, values))
+
+        rows = list(items.order_by(*ordering)[:pager.page_size + 1])
+        has_more = len(rows) > pager.page_size
+        rows = rows[:pager.page_size]
+
+        if direction == PREVIOUS:
+            rows.reverse()
+            ordering = [self.__reverse__(field) for field in ordering]
+
+        has_next = has_more if direction == NEXT else values != None
+        has_previous = values != None if direction == NEXT else has_more
+
+        next_cursor = encode_cursor(self.__key__(rows[-1], ordering), NEXT) if rows and has_next else None
+        prev_cursor = encode_cursor(self.__key__(rows[0], ordering), PREVIOUS) if rows and has_previous else None
+
+        return PagedCollection(page_size = pager.page_size, data = rows, keyset = True, next_cursor = next_cursor, prev_cursor = prev_cursor)
+
+    def __keyset_ordering__(self, items):
+        ordering = list(items.query.order_by or items.model._meta.ordering)
+        pk_name = items.model._meta.pk.name
+        if not any(field.lstrip('-') in ('pk', 'id', pk_name) for field in ordering):
+            last_descending = ordering and ordering[-1].startswith('-')
+            ordering.append(f'-{pk_name}' if last_descending else pk_name)
+        return ordering
+
+    def __reverse__(self, field):
+        return field[1:] if field.startswith('-') else f'-{field}'
+
+    def __key__(self, row, ordering):
+        return [getattr(row, field.lstrip('-')) for field in ordering]
+
+    def __seek__(self, ordering, values):
+        '''
+            Builds (a > x) OR (a = x AND b > y) ... honouring the direction of every ordering field
+        '''
+        seek = Q()
+        equal = Q()
+        for field, value in zip(ordering, values):
+            name = field.lstrip('-')
+            lookup = 'lt' if field.startswith('-') else 'gt'
+            seek |= equal & Q(**{f'{name}__{lookup}': value})
+            equal &= Q(**{name: value})
+        return seek
@@ -0,0 +1,115 @@
+import heapq, time, threading
+
+from collections import defaultdict
+
+NGRAM_SIZE = 3
+MAX_SHORT_LENGTH = NGRAM_SIZE - 1
+DEFAULT_LIMIT = 10
+
+class PrepopIndex():
+    '''
+        In-process autocomplete index over the prepop terms.
+
+        Short queries (up to MAX_SHORT_LENGTH characters) are answered from a table of every
+        substring that short, so "ab" still finds "Kebab". Longer queries intersect the trigram
+        postings of the query and only verify the surviving candidates, so a lookup never scans
+        the whole catalogue.
+    '''
+    def __init__(self, terms = None, version = None):
+        self.version = version
+        self.terms = []
+        self.lowered = []
+        self.short = defaultdict(set)
+        self.trigrams = defaultdict(set)
+
+        for term in terms or []:
+            self.__index_term__(term)
+
+    def __index_term__(self, term):
+        term_id = len(self.terms)
+        lowered = term.lower()
+        self.terms.append(term)
+        self.lowered.append(lowered)
+
+        for size in range(1, MAX_SHORT_LENGTH + 1):
+            for i in range(len(lowered) - size + 1):
+                self.short[lowered[i:i + size]].add(term_id)
+
+        for i in range(len(lowered) - NGRAM_SIZE + 1):
+            self.trigrams[lowered[i:i + NGRAM_SIZE]].add(term_id)
+
+    def __len__(self):
+        return len(self.terms)
+
+    def __candidates__(self, query):
+        if len(query) <= MAX_SHORT_LENGTH:
+            return self.short.get(query, set())
+
+        grams = sorted((self.trigrams.get(query[i:i + NGRAM_SIZE], set()) for i in range(len(query) - NGRAM_SIZE + 1)), key = len)
+        if not grams or not grams[0]:
+            return set()
+
+        candidates = set(grams[0])
+        for gram in grams[1:]:
+            candidates &= gram
+            if not candidates:
+                break
+        return candidates
+
+    def __rank__(self, query, lowered):
+        if lowered == query:
+            return 0
+        if lowered.startswith(query):
+            return 1
+        if f' {query}' in lowered:
+            return 2
+        return 3
+
+    def search(self, query, limit = DEFAULT_LIMIT):
+        '''
+            Returns up to @limit terms containing @query, best matches first:
+            exact, then prefix, then word prefix, then any other substring; shorter terms win ties.
+        '''
+        query = query.strip().lower() if query else ''
+        if not query:
+            return []
+
+        matches = []
+        for term_id in self.__candidates__(query):
+            lowered = self.lowered[term_id]
+            if query not in lowered:
+                continue
+            matches.append((self.__rank__(query, lowered), len(lowered), lowered, term_id))
+
+        # a one letter query matches most of the catalogue, only the best @limit need ordering
+        return [self.terms[m[3]] for m in heapq.nsmallest(limit, matches)]
+
+
+class PrepopIndexHolder():
+    '''
+        Keeps one PrepopIndex per process and reloads it when the version stored next to the
+        prepop list changes. The version key is only checked every @check_interval seconds.
+    '''
+    def __init__(self, check_interval = 5):
+        self.index = PrepopIndex()
+        self.check_interval = check_interval
+        self.checked_at = 0
+        self.lock = threading.Lock()
+
+    def get(self, cache, list_key, version_key):
+        now = time.monotonic()
+        if now - self.checked_at < self.check_interval:
+            return self.index
+
+        with self.lock:
+            if now - self.checked_at < self.check_interval:
+                return self.index
+
+            version = cache.get(version_key, None)
+            if version != None and version != self.index.version:
+                self.index = PrepopIndex(cache.get(list_key, []), version)
+            self.checked_at = now
+
+        return self.index
+
+prepop_index = PrepopIndexHolder()
@@ -1,18 +1,33 @@
-import datetime
+import datetime, uuid
 
-from django.db.models import Q
+from django.db.models import Q, F, Prefetch, DecimalField
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import Cast
+from django.contrib.postgres.search import SearchRank
 from django.conf import settings
+from django.db import connection
 from utils.app_logger import get_logger
-from domain.models import Restaurant
+from domain.models import Restaurant, RestaurantOperatingHours, restaurant_search_vector
+from domain.constants import SEARCH_CONFIG
+from domain.base.geography import SRID
+from domain.base.search import PrefixSearchQuery
 from .cache.restaurants_cache import RestaurantsCache
 from .appuser_service import AppUserService
 from .base.service_base import ServiceBase
-from .pagination_service import PaginationService, Pager
+from .pagination_service import PaginationService, Pager, PagedCollection, encode_cursor, decode_cursor
 from .cloudinary_service import upload
 from .google_maps import get_latlng
+from .prepop_index import prepop_index
+from .geo_index import restaurants_geo_index, haversine_many
+from .cache.nearby_cache import NearbyCache
+from .cache.tags import restaurant_tag, appuser_restaurants_tag, restaurants_tag
 
 logger = get_logger(__name__)
 
+PREPOP_LIMIT = 10
+SEARCH_MODE_FULL_TEXT = 'fts'
+SEARCH_MODE_CONTAINS = 'contains'
+
 class RestaurantsService(ServiceBase):
     def __init__(self):
         self.cache = RestaurantsCache()
@@ -29,21 +44,33 @@ class RestaurantsService(ServiceBase):
     def get_queryset(self):
         return Restaurant.objects.all()
 
-    def check_admin(self, appuser_id, restaurant_id):
-        cache_key = f'check_admin?appuser_id={appuser_id}&restaurant_id={restaurant_id}'
-        is_admin = self.cache.get(cache_key, None)
-
-        if is_admin != None:
-            return is_admin
-
-        q = Q()
-        q &= Q(appuser_id = appuser_id)
-        q &= Q(id = restaurant_id)
+    def __admin_key__(self, appuser_id):
+        return f'check_admin/?appuser_id={appuser_id}'
 
-        is_admin = Restaurant.objects.filter(q).exists()
-        self.cache.set(cache_key, is_admin)
+    def check_admin(self, appuser_id, restaurant_id):
+        return self.check_admin_many(appuser_id, [restaurant_id])[int(restaurant_id)]
 
-        return is_admin
+    def check_admin_many(self, appuser_id, restaurant_ids):
+        '''
+            Whether app user @appuser_id administers each of @restaurant_ids, {restaurant_id: is_admin}. The answers
+            are fields of one Redis hash per app user, read in one round trip; the restaurants it does not hold yet
+            are checked with one query. clear_admin drops the hash when one of the app user's restaurants changes
+        '''
+        key = self.__admin_key__(appuser_id)
+        restaurant_ids = list(set(int(restaurant_id) for restaurant_id in restaurant_ids))
+
+        result = {restaurant_id: is_admin == '1' for restaurant_id, is_admin in self.cache.hash_get(key, restaurant_ids).items() if is_admin != None}
+        missing = [restaurant_id for restaurant_id in restaurant_ids if restaurant_id not in result]
+        if missing:
+            owned = set(Restaurant.objects.filter(appuser_id = appuser_id, id__in = missing).values_list('id', flat = True))
+            loaded = {restaurant_id: restaurant_id in owned for restaurant_id in missing}
+            self.cache.hash_set(key, {restaurant_id: int(is_admin) for restaurant_id, is_admin in loaded.items()}, settings.FIFTEEN_MINUTES)
+            result.update(loaded)
+        return result
+
+    def clear_admin(self, *appuser_ids):
+        for appuser_id in appuser_ids:
+            self.cache.delete(self.__admin_key__(appuser_id))
 
     def create(self, appuser_id, banner, **kwargs):
         logger.info(f'Creating restaurant for appuser {appuser_id}')
@@ -71,37 +98,50 @@ class RestaurantsService(ServiceBase):
             return None
 
 
+    def get_id_by_slug(self, slug):
+        def load():
+            return Restaurant.objects.filter(slug = slug).values_list('id', flat = True).first()
+
+        return self.cache.get_or_compute(self.__id_by_slug_key__(slug), load, settings.ONE_DAY, negative_timeout = settings.NEGATIVE_CACHE_TIMEOUT)
+
+    def __id_by_slug_key__(self, slug):
+        return f'get_id_by_slug/?slug={slug}'
+
+    def clear_missing(self, slug):
+        '''
+            Forgets that @slug did not exist, called when a restaurant is created with it
+        '''
+        self.cache.delete(self.__id_by_slug_key__(slug))
+
     def get(self, slug):
-        restaurant = self.cache.search_by_id_or_slug(slug, type='slug')
-        if restaurant != None:
-            return restaurant
-        try:
-            restaurant = Restaurant.objects.prefetch_related('reviews').get(slug = slug, active = True)
-            #self.cache.set(slug, restaurant)
-            return restaurant
-        except Restaurant.DoesNotExist:
+        restaurant_id = self.get_id_by_slug(slug)
+        if restaurant_id == None:
             return None
 
-    def get_by_appuser(self, appuser_id, page = settings.PAGE_NUMBER, size = settings.PAGE_SIZE):
-        cache_key = f'get_by_appuser/?appuser_id={appuser_id}&page={page}&size={size}'
+        def load():
+            try:
+                return Restaurant.objects.prefetch_related('reviews').get(slug = slug, active = True)
+            except Restaurant.DoesNotExist:
+                return None
 
-        restaurants = self.cache.get(cache_key, None)
-        if restaurants != None:
-            return restaurants
+        return self.cache.get_or_compute(f'get/?slug={slug}', load, settings.ENTITY_CACHE_TIMEOUT, tags = (restaurant_tag(restaurant_id),), negative_timeout = settings.NEGATIVE_CACHE_TIMEOUT)
 
-        q = Q()
-        q &= Q(appuser_id = appuser_id)
+    def get_by_appuser(self, appuser_id, page = settings.PAGE_NUMBER, size = settings.PAGE_SIZE, cursor = None):
+        cache_key = f'get_by_appuser/?appuser_id={appuser_id}&page={page}&size={size}&cursor={cursor}'
 
-        paginator = Pager(Restaurant.objects.all(), page, size)
-        paged = PaginationService().paginate(paginator, q)
+        def load():
+            q = Q()
+            q &= Q(appuser_id = appuser_id)
 
-        self.cache.set(cache_key, paged, 15)
+            paginator = Pager(Restaurant.objects.all(), page, size, cursor)
+            return PaginationService().paginate(paginator, q)
 
-        return paged
+        return self.cache.get_or_compute(cache_key, load, settings.ENTITY_CACHE_TIMEOUT, tags = (appuser_restaurants_tag(appuser_id),))
 
     def update(self, id, **kwargs):
-        restaurant = self.get(id)
-        if restaurant == None:
+        try:
+            restaurant = Restaurant.objects.get(pk = id)
+        except Restaurant.DoesNotExist:
             return None
         try:
             restaurant.name = kwargs.get('name')
@@ -111,30 +151,30 @@ class RestaurantsService(ServiceBase):
             restaurant.tagline = kwargs.get('tagline')
             restaurant.suburb = kwargs.get('suburb')
             restaurant.city = kwargs.get('city')
-            restaurant.cuisin = kwargs.get('cuisine')
-            restaurant.updated = datetime.datetime.now()
+            restaurant.cuisine = kwargs.get('cuisine')
+            restaurant.last_updated = datetime.datetime.now()
 
             restaurant.save()
 
-            self.cache.set(id, restaurant)
-
             return restaurant
         except Exception as e:
             logger.exception(f'Could not update restaurant {id}')
             return None
 
-    def search(self, query, page = settings.PAGE_NUMBER, size = settings.PAGE_SIZE):
+    def search(self, query, page = settings.PAGE_NUMBER, size = settings.PAGE_SIZE, mode = SEARCH_MODE_FULL_TEXT, cursor = None):
         if query.strip() == '':
             return []
 
-        cache_key = f'search/?q={query}&page={page}&size={size}'
+        cache_key = f'search/?q={query}&page={page}&size={size}&mode={mode}&cursor={cursor}'
 
-        data = self.cache.get(cache_key, None)
-        '''if data != None:
-            return data'''
+        def load():
+            if mode == SEARCH_MODE_FULL_TEXT:
+                return self.__full_text_search__(query, page, size, cursor)
+            return self.__contains_search__(query, page, size, cursor)
 
-        data = [] 
+        return self.cache.get_or_compute(cache_key, load, tags = (restaurants_tag(),))
 
+    def __contains_search__(self, query, page, size, cursor = None):
         q = Q()
 
         q |= Q(name__icontains = query)
@@ -144,12 +184,33 @@ class RestaurantsService(ServiceBase):
         q &= Q(operating_hours__day = 6)
         q &= Q(active = True)
 
-        paginator = Pager(Restaurant.objects.prefetch_related('operating_hours').all(), page, size)
-        paged = PaginationService().paginate(paginator, q)
+        paginator = Pager(Restaurant.objects.prefetch_related('operating_hours').all(), page, size, cursor)
+        return PaginationService().paginate(paginator, q)
 
-        self.cache.set(cache_key, paged)
+    def __full_text_search__(self, query, page, size, cursor = None):
+        search_query = PrefixSearchQuery(query, config = SEARCH_CONFIG)
 
-        return paged
+        q = Q()
+        q &= Q(search_vector = search_query)
+        q &= Q(operating_hours__day = 6)
+        q &= Q(active = True)
+
+        # ts_rank is a float4, which no python float cursor value compares equal to. Ordering and seeking
+        # on a fixed precision numeric keeps ties tied and round trips exactly through the cursor
+        rank = Cast(SearchRank(F('search_vector'), search_query), DecimalField(max_digits = 12, decimal_places = 8))
+        restaurants = Restaurant.objects \
+                        .prefetch_related('operating_hours') \
+                        .annotate(rank = rank) \
+                        .order_by('-rank', '-id')
+
+        paginator = Pager(restaurants, page, size, cursor)
+        return PaginationService().paginate(paginator, q)
+
+    def update_search_vectors(self):
+        '''
+            Recomputes the search vector of every restaurant. Needed once for rows saved before the column existed
+        '''
+        return Restaurant.objects.update(search_vector = restaurant_search_vector())
 
     def is_active(self, id):
         field_list = ('active',)
@@ -160,18 +221,14 @@ class RestaurantsService(ServiceBase):
 
     def get_ids_and_status(self, appuser_id):
         cache_key = f'get_ids_and_status?appuser_id{appuser_id}'
-        result = self.cache.get(cache_key)
-        if result != None:
-            return result
 
-        field_list = ('id', 'active')
-        result = self.get_fields(field_list, **{
-                    'appuser_id': appuser_id
-                })
+        def load():
+            field_list = ('id', 'active')
+            return list(self.get_fields(field_list, **{
+                        'appuser_id': appuser_id
+                    }))
 
-        self.cache.set(cache_key, result, 60)
-
-        return list(result)
+        return self.cache.get_or_compute(cache_key, load, 60)
 
     def get_by_appuser_id(self, appuser_id):
         q = Q()
@@ -188,63 +245,181 @@ class RestaurantsService(ServiceBase):
             'active': True
         }).distinct())
         cache = []
+        seen = set()
         for data in prepop_data:
-            cache.append(data['name'].strip())
-            cache.append(data['suburb'].strip())
-            cache.append(data['city'].strip())
-            split = data['cuisine'].split(',')
-            for s in split:
-                cache.append(s.strip())
+            terms = [data['name'], data['suburb'], data['city']] + data['cuisine'].split(',')
+            for term in terms:
+                term = term.strip()
+                if term and term.lower() not in seen:
+                    seen.add(term.lower())
+                    cache.append(term)
 
-        self.cache.set('prepop', cache, 60 * 60 * 24)
+        self.cache.set('prepop', cache, settings.ONE_DAY)
+        self.cache.set('prepop_version', uuid.uuid4().hex, settings.ONE_DAY)
 
-    def query_prepop(self, query = ''):
+    def query_prepop(self, query = '', limit = PREPOP_LIMIT):
         if not query or query.strip() == '':
             return []
 
-        data = self.cache.get('prepop', [])
+        index = prepop_index.get(self.cache, 'prepop', 'prepop_version')
 
-        if len(data) == 0:
-            return []
+        return index.search(query, limit)
 
-        query = query.lower()
+    def get_within_radius(self, lat, lng, size = settings.PAGE_SIZE, cursor = None):
+        '''
+            Returns the nearest active restaurants open today within settings.SEARCH_RADIUS, closest first,
+            seeking past (distance, id) of the cursor row instead of offsetting.
+        '''
+        today = datetime.datetime.today().weekday()
+        pager = Pager(None, page_size = size, cursor = cursor or '')
+        after, _ = decode_cursor(pager.cursor)
+
+        if settings.GEO_CACHE_CELL_SIZE:
+            return self.__nearest_from_cell_cache__(float(lat), float(lng), today, pager, after)
 
-        ret = [d for d in data if query in d.lower() or query == d.lower()]
+        return self.__nearest__(lat, lng, today, pager, after)
 
-        return set(ret)
+    def __nearest__(self, lat, lng, today, pager, after):
+        if settings.GEO_INDEX_ENABLED:
+            return self.__nearest_from_index__(lat, lng, today, pager, after)
+        return self.__nearest_from_db__(lat, lng, today, pager, after)
 
-    def get_within_radius(self, lat, lng):
-        
+    def __nearest_from_db__(self, lat, lng, today, pager, after):
         '''
-            CREATE INDEX IF NOT EXISTS restaurants_gix ON restaurants USING GIST (Geography(ST_MakePoint(longitude, latitude)));
-            CREATE INDEX IF NOT EXISTS liqour_outlets_gix ON liqour_outlets USING GIST (Geography(ST_MakePoint(longitude, latitude)))
+            Uses the GiST index on restaurants.location for both the radius filter and the KNN ordering
         '''
-        today = datetime.datetime.today().weekday()
+        origin = 'ST_MAKEPOINT(%s, %s)::GEOGRAPHY'
+        params = [lng, lat, lng, lat, settings.SEARCH_RADIUS, today]
+        seek = ''
+
+        if after != None:
+            seek = f'AND (R.LOCATION <-> {origin}, R.ID) > (%s, %s)'
+            params += [lng, lat] + after
 
-        query = '''SELECT 	R.ID,
+        params += [lng, lat, pager.page_size + 1]
+
+        query = f'''SELECT 	R.ID,
                         R.NAME,
 		                R.SLUG,
                         R.BANNER_URL,
                         R.CUISINE,
                         ROH.CLOSES,
-                        (
-                            SELECT ST_DISTANCESPHERE(
-                                ST_MAKEPOINT(R.LONGITUDE, R.LATITUDE),
-                                ST_MAKEPOINT(%s, %s)
-                            )
-                        ) AS DISTANCE
+                        R.LOCATION <-> {origin} AS DISTANCE
                 FROM RESTAURANTS R
                 INNER JOIN RESTAURANTS_OPERATING_HOURS ROH
                 ON ROH.RESTAURANT_ID = R.ID
-                WHERE ST_DWITHIN (
-                        ST_MAKEPOINT(LONGITUDE, LATITUDE)::GEOGRAPHY,
-                        ST_MAKEPOINT(%s, %s)::GEOGRAPHY,
-                        %s)
+                WHERE ST_DWITHIN(R.LOCATION, {origin}, %s)
                 AND ROH.DAY = %s
-                AND ACTIVE = TRUE
+                AND R.ACTIVE = TRUE
+                {seek}
+                ORDER BY R.LOCATION <-> {origin}, R.ID
+                LIMIT %s
                 '''
 
-        in_radius = Restaurant.objects.prefetch_related('operating_hours').raw(
-            query, [lng, lat, lng, lat, settings.SEARCH_RADIUS,today])
+        rows = list(Restaurant.objects.raw(query, params))
+        next_cursor = None
+        if len(rows) > pager.page_size:
+            rows = rows[:pager.page_size]
+            next_cursor = encode_cursor([rows[-1].distance, rows[-1].id])
+
+        return PagedCollection(page_size = pager.page_size, data = rows, keyset = True, next_cursor = next_cursor)
 
-        return in_radius
+    def __nearest_from_index__(self, lat, lng, today, pager, after):
+        '''
+            Answers get_within_radius from the in-process grid index, only loading the rows of the page
+        '''
+        nearest = restaurants_geo_index.get().within(lat, lng, settings.SEARCH_RADIUS, today, after, pager.page_size + 1)
+        next_cursor = None
+        if len(nearest) > pager.page_size:
+            nearest = nearest[:pager.page_size]
+            next_cursor = encode_cursor(list(nearest[-1]))
+
+        todays_hours = Prefetch('operating_hours', queryset = RestaurantOperatingHours.objects.filter(day = today))
+        restaurants = Restaurant.objects.prefetch_related(todays_hours).in_bulk([id for _, id in nearest])
+
+        rows = []
+        for distance, id in nearest:
+            restaurant = restaurants.get(id)
+            if restaurant == None:
+                continue
+            todays_hours = restaurant.operating_hours.all()
+            restaurant.closes = todays_hours[0].closes if todays_hours else None
+            restaurant.distance = distance
+            rows.append(restaurant)
+
+        return PagedCollection(page_size = pager.page_size, data = rows, keyset = True, next_cursor = next_cursor)
+
+    def __nearest_from_cell_cache__(self, lat, lng, today, pager, after):
+        '''
+            Snaps the location to a cell, caches per weekday the settings.GEO_CACHE_CELL_LIMIT restaurants nearest
+            to its center that can be within range of any point of the cell, then measures the exact distances for
+            this request. When the cell has more, the candidates are only complete up to the farthest of them less
+            the distance from the center, and a page reaching past that is read with __nearest__ instead
+        '''
+        nearby_cache = NearbyCache(settings.GEO_CACHE_CELL_SIZE, settings.GEO_CACHE_TILE_SIZE)
+        cell, center = nearby_cache.snap(lat, lng)
+        cell_radius = nearby_cache.cell_radius(settings.SEARCH_RADIUS)
+        tags = nearby_cache.tile_tags(center[0], center[1], cell_radius)
+        limit = settings.GEO_CACHE_CELL_LIMIT
+
+        cache_key = f'nearest/?cell={cell[0]},{cell[1]}&day={today}&limit={limit}'
+        nearest_to_center = nearby_cache.get_or_compute(cache_key, lambda: self.__nearby_candidates__(center, cell_radius, today, limit), settings.ONE_HOUR, tags = tags)
+        candidates = nearest_to_center['candidates']
+
+        # every restaurant this close to the location is a candidate
+        complete = min(settings.SEARCH_RADIUS, nearest_to_center['reach'] - haversine_many(lat, lng, [center[0]], [center[1]])[0])
+
+        distances = haversine_many(lat, lng, [c['latitude'] for c in candidates], [c['longitude'] for c in candidates])
+        nearest = sorted(((distance, c['id'], c) for distance, c in zip(distances, candidates) if distance <= complete), key = lambda n: n[:2])
+        if after != None:
+            nearest = [n for n in nearest if n[:2] > tuple(after)]
+
+        if len(nearest) <= pager.page_size and complete < settings.SEARCH_RADIUS:
+            return self.__nearest__(lat, lng, today, pager, after)
+
+        next_cursor = None
+        if len(nearest) > pager.page_size:
+            nearest = nearest[:pager.page_size]
+            next_cursor = encode_cursor(list(nearest[-1][:2]))
+
+        rows = [dict(candidate, distance = distance) for distance, _, candidate in nearest]
+        return PagedCollection(page_size = pager.page_size, data = rows, keyset = True, next_cursor = next_cursor)
+
+    def __nearby_candidates__(self, center, radius, today, limit):
+        '''
+            The @limit active restaurants open on @today nearest to @center within @radius, closest first, and
+            their reach: the distance up to which no other restaurant is nearer, @radius when there are fewer
+        '''
+        if settings.GEO_INDEX_ENABLED:
+            nearest = restaurants_geo_index.get().within(center[0], center[1], radius, today, limit = limit)
+            # another process's index can be minutes behind, the database has the final say on active
+            restaurants = Restaurant.objects.filter(id__in = [id for _, id in nearest], active = True, operating_hours__day = today)
+        else:
+            knn = RawSQL('LOCATION <-> ST_MAKEPOINT(%s, %s)::GEOGRAPHY', [center[1], center[0]])
+            restaurants = Restaurant.objects \
+                            .filter(active = True, operating_hours__day = today) \
+                            .extra(where = ['ST_DWITHIN(LOCATION, ST_MAKEPOINT(%s, %s)::GEOGRAPHY, %s)'], params = [center[1], center[0], radius]) \
+                            .order_by(knn, 'id')[:limit]
+
+        rows = list(restaurants.values('id', 'name', 'slug', 'banner_url', 'cuisine', 'latitude', 'longitude', closes = F('operating_hours__closes')))
+        for row in rows:
+            row['latitude'], row['longitude'] = float(row['latitude']), float(row['longitude'])
+
+        if settings.GEO_INDEX_ENABLED:
+            reach = nearest[-1][0] if len(nearest) >= limit else radius
+        else:
+            reach = max(haversine_many(center[0], center[1], [row['latitude'] for row in rows], [row['longitude'] for row in rows])) if len(rows) >= limit else radius
+        return {'candidates': rows, 'reach': reach}
+
+    def sync_locations(self):
+        '''
+            Fills restaurants.location from latitude/longitude for rows saved before the column existed
+        '''
+        if settings.POSTGIS_ENABLED:
+            point = f'ST_SETSRID(ST_MAKEPOINT(LONGITUDE, LATITUDE), {SRID})::GEOGRAPHY'
+        else:
+            point = f"'SRID={SRID};POINT(' || LONGITUDE || ' ' || LATITUDE || ')'"
+
+        with connection.cursor() as cursor:
+            cursor.execute(f'UPDATE RESTAURANTS SET LOCATION = {point} WHERE LOCATION IS NULL')
+            return cursor.rowcount
@@ -15,11 +15,11 @@ class RestaurantsReviewService(ServiceBase):
         return restaurant_review
 
 
-    def get(self, slug, page_number, page_size):
+    def get(self, slug, page_number, page_size, cursor = None):
         q = Q()
         q &= Q(restaurant__slug = slug)
 
-        pager = Pager(RestaurantReview.objects.select_related('rated_by').all(), page_number, page_size)
+        pager = Pager(RestaurantReview.objects.select_related('rated_by').all(), page_number, page_size, cursor)
         paged = PaginationService().paginate(pager, q)
 
         return paged
\ No newline at end of file
@@ -0,0 +1,129 @@
+from django.contrib.auth.models import User
+from django.db.models.signals import post_init, post_save, post_delete, m2m_changed
+from django.db import transaction
+from django.dispatch import receiver
+from django.conf import settings
+
+from domain.models import Restaurant, RestaurantOperatingHours, RestaurantMenuItemCategory, RestaurantMenuItem, \
+                          OptionCategory, Option, RestaurantMenuItemOption, ChatRoom, Order
+from .geo_index import restaurants_geo_index
+from .cache.nearby_cache import NearbyCache
+from .cache.restaurants_cache import RestaurantsCache
+from .cache.tags import restaurant_tag, appuser_restaurants_tag, restaurants_tag, orders_tag
+from .restaurants import RestaurantsService
+from .chat_service import ChatService
+from .order_feed_service import OrderFeedService
+from .user_service import UserService
+
+def __nearby_cache__():
+    return NearbyCache(settings.GEO_CACHE_CELL_SIZE, settings.GEO_CACHE_TILE_SIZE)
+
+def __bump__(*tags):
+    '''
+        Bumps @tags once the current transaction commits, so no request can cache the old rows under the new generations
+    '''
+    transaction.on_commit(lambda: RestaurantsCache().bump(*tags))
+
+def __bump_location__(lat, lng):
+    transaction.on_commit(lambda: __nearby_cache__().bump_location(lat, lng))
+
+def __geo_changed__(restaurant_id):
+    # queued before the restaurants_tag() bump, so a process seeing the new generation also sees the change
+    if settings.GEO_INDEX_ENABLED:
+        transaction.on_commit(lambda: restaurants_geo_index.changed(restaurant_id))
+
+def __bump_restaurant__(restaurant_id, *tags):
+    if restaurant_id != None:
+        __bump__(restaurant_tag(restaurant_id), *tags)
+
+@receiver(post_init, sender = Restaurant)
+def restaurant_loaded(sender, instance, **kwargs):
+    # remembered so that a move also invalidates the tile the restaurant is leaving. Read from __dict__:
+    # touching a deferred field would load it, building another instance and landing back here
+    instance._loaded_location = (instance.__dict__.get('latitude'), instance.__dict__.get('longitude'))
+    instance._loaded_appuser_id = instance.__dict__.get('appuser_id')
+
+def __clear_admin__(*appuser_ids):
+    appuser_ids = set(appuser_id for appuser_id in appuser_ids if appuser_id != None)
+    transaction.on_commit(lambda: RestaurantsService().clear_admin(*appuser_ids))
+
+@receiver(post_save, sender = Restaurant)
+def restaurant_saved(sender, instance, created = False, **kwargs):
+    if created:
+        transaction.on_commit(lambda: RestaurantsService().clear_missing(instance.slug))
+    __bump_location__(instance.latitude, instance.longitude)
+    previous = getattr(instance, '_loaded_location', None)
+    if not created and previous != None and None not in previous and previous != (instance.latitude, instance.longitude):
+        __bump_location__(*previous)
+    instance._loaded_location = (instance.latitude, instance.longitude)
+    __clear_admin__(instance.appuser_id, getattr(instance, '_loaded_appuser_id', None))
+    instance._loaded_appuser_id = instance.appuser_id
+    __geo_changed__(instance.id)
+    __bump__(restaurant_tag(instance.id), appuser_restaurants_tag(instance.appuser_id), restaurants_tag())
+
+@receiver(post_delete, sender = Restaurant)
+def restaurant_deleted(sender, instance, **kwargs):
+    restaurant_id = instance.id
+    __bump_location__(instance.latitude, instance.longitude)
+    __clear_admin__(instance.appuser_id)
+    __geo_changed__(restaurant_id)
+    __bump__(restaurant_tag(restaurant_id), appuser_restaurants_tag(instance.appuser_id), restaurants_tag())
+
+@receiver(post_save, sender = RestaurantOperatingHours)
+@receiver(post_delete, sender = RestaurantOperatingHours)
+def operating_hours_changed(sender, instance, **kwargs):
+    restaurant_id = instance.restaurant_id
+    location = Restaurant.objects.filter(pk = restaurant_id).values_list('latitude', 'longitude').first()
+    if location:
+        __bump_location__(*location)
+    __geo_changed__(restaurant_id)
+    __bump_restaurant__(instance.restaurant_id, restaurants_tag())
+
+@receiver(post_save, sender = RestaurantMenuItemCategory)
+@receiver(post_delete, sender = RestaurantMenuItemCategory)
+@receiver(post_save, sender = OptionCategory)
+@receiver(post_delete, sender = OptionCategory)
+@receiver(post_save, sender = RestaurantMenuItemOption)
+@receiver(post_delete, sender = RestaurantMenuItemOption)
+def restaurant_child_changed(sender, instance, **kwargs):
+    __bump_restaurant__(instance.restaurant_id)
+
+@receiver(post_save, sender = RestaurantMenuItem)
+@receiver(post_delete, sender = RestaurantMenuItem)
+def menu_item_changed(sender, instance, **kwargs):
+    restaurant_id = RestaurantMenuItemCategory.objects.filter(pk = instance.category_id).values_list('restaurant_id', flat = True).first()
+    __bump_restaurant__(restaurant_id)
+
+@receiver(post_save, sender = Option)
+@receiver(post_delete, sender = Option)
+def option_changed(sender, instance, **kwargs):
+    restaurant_id = OptionCategory.objects.filter(pk = instance.category_id).values_list('restaurant_id', flat = True).first()
+    __bump_restaurant__(restaurant_id)
+
+@receiver(post_save, sender = ChatRoom)
+def chatroom_saved(sender, instance, created = False, **kwargs):
+    if created:
+        transaction.on_commit(lambda: ChatService().clear_missing(instance.name))
+
+@receiver(post_save, sender = Order)
+@receiver(post_delete, sender = Order)
+def order_changed(sender, instance, **kwargs):
+    __bump__(orders_tag(instance.restaurant_id))
+
+@receiver(m2m_changed, sender = User.groups.through)
+def user_groups_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'pre_clear'):
+        return
+    if not reverse:
+        user_ids = [instance.pk]
+    elif action == 'pre_clear':
+        user_ids = list(instance.user_set.values_list('id', flat = True))
+    else:
+        user_ids = list(pk_set)
+    transaction.on_commit(lambda: UserService().clear_groups(*user_ids))
+
+@receiver(post_save, sender = Order)
+def order_saved(sender, instance, created = False, **kwargs):
+    feed = OrderFeedService()
+    event = feed.event(instance, created)
+    transaction.on_commit(lambda: feed.publish(instance.id, event))
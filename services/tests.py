@@ -1,3 +1,144 @@
-from django.test import TestCase
+import threading, time, uuid
 
-# Create your tests here.
+from django.test import SimpleTestCase
+
+from services.cache.base.cache_base import CacheBase
+from services.cache.base.local_cache import LocalCache
+from services.cache.base.metrics import key_family
+from services.pagination_service import PagedCollection
+from services.prepop_index import PrepopIndex
+
+class LocalCacheTests(SimpleTestCase):
+    def test_get_returns_a_copy(self):
+        cache = LocalCache()
+        value = {'data': [1, 2]}
+        cache.set('key', value)
+        value['data'].append(3)
+
+        found, first = cache.get('key')
+        first['data'].append(4)
+        _, second = cache.get('key')
+
+        self.assertTrue(found)
+        self.assertEqual(second, {'data': [1, 2]})
+
+    def test_expired_entries_are_misses(self):
+        cache = LocalCache(ttl = -1)
+        cache.set('key', 1)
+
+        self.assertEqual(cache.get('key'), (False, None))
+
+
+class ListSerializer():
+    def __init__(self, data, many = False):
+        self.data = [{'value': item} for item in data]
+
+class PagedCollectionTests(SimpleTestCase):
+    def test_serialize_data_leaves_the_collection_untouched(self):
+        collection = PagedCollection(page_size = 10, data = [1, 2], keyset = True)
+
+        first = collection.serialize_data(ListSerializer)
+        second = collection.serialize_data(ListSerializer)
+
+        self.assertEqual(collection.data, [1, 2])
+        self.assertEqual(first, second)
+        self.assertEqual(second['data'], [{'value': 1}, {'value': 2}])
+
+class KeyFamilyTests(SimpleTestCase):
+    def test_families_are_key_names(self):
+        self.assertEqual(key_family('get_menu_document/?name=burger-palace'), 'get_menu_document')
+        self.assertEqual(key_family('gallery/?restaurant_id=42'), 'gallery')
+        self.assertEqual(key_family('idempotency/?appuser_id=7&key=abc'), 'idempotency')
+
+    def test_ids_do_not_make_families(self):
+        self.assertEqual(key_family(42), 'other')
+        self.assertEqual(key_family('7/abc'), 'other')
+        self.assertEqual(key_family('?q=x'), 'other')
+
+class CollectionTests(SimpleTestCase):
+    def setUp(self):
+        self.cache = CacheBase('tests_')
+        self.keys = ('recent', 'list', 'set', 'hash')
+        for key in self.keys:
+            self.cache.delete(key)
+
+    def tearDown(self):
+        for key in self.keys:
+            self.cache.delete(key)
+
+    def ttl(self, key):
+        return self.cache.__redis__().ttl(self.cache.__raw_key__(key))
+
+    def test_add_or_update_keeps_the_most_recent_values(self):
+        for value in ('a', 'b', 'c', 'a'):
+            self.cache.add_or_update('recent', value, 3, 60)
+        since = time.time()
+        self.cache.add_or_update('recent', 'd', 3, 60)
+
+        self.assertEqual(self.cache.recent_since('recent', 0), ['c', 'a', 'd'])
+        self.assertEqual(self.cache.recent_since('recent', since), ['d'])
+        self.assertTrue(0 < self.ttl('recent') <= 60)
+
+    def test_list_push_caps_the_list(self):
+        for value in ('a', 'b', 'c', 'd'):
+            self.cache.list_push('list', value, 3, 60)
+
+        self.assertEqual(self.cache.list_range('list', 10), ['d', 'c', 'b'])
+        self.assertEqual(self.cache.list_range('list', 2), ['d', 'c'])
+        self.assertTrue(0 < self.ttl('list') <= 60)
+
+    def test_set_add_and_members(self):
+        self.assertEqual(self.cache.members('set'), set())
+        self.cache.set_add('set', ['a', 'b'], 60)
+        self.cache.set_add('set', ['b', 'c'], 60)
+
+        self.assertEqual(self.cache.members('set'), {'a', 'b', 'c'})
+        self.assertTrue(0 < self.ttl('set') <= 60)
+
+    def test_hash_set_and_get(self):
+        self.cache.hash_set('hash', {1: 1, 2: 0}, 60)
+
+        self.assertEqual(self.cache.hash_get('hash', [1, 2, 3]), {1: '1', 2: '0', 3: None})
+        self.assertTrue(0 < self.ttl('hash') <= 60)
+
+    def test_collections_are_deleted_like_any_key(self):
+        self.cache.list_push('list', 'a', 3, 60)
+        self.cache.delete('list')
+
+        self.assertEqual(self.cache.list_range('list', 10), [])
+
+class PrepopIndexTests(SimpleTestCase):
+    def test_short_queries_match_inside_words(self):
+        index = PrepopIndex(['Kebab Hut', 'Abby\'s Diner', 'Burger Palace', 'Fab Pizza'])
+
+        self.assertEqual(index.search('ab'), ['Abby\'s Diner', 'Fab Pizza', 'Kebab Hut'])
+        self.assertEqual(index.search('K'), ['Kebab Hut'])
+        self.assertEqual(index.search('zz'), ['Fab Pizza'])
+        self.assertEqual(index.search('xy'), [])
+
+    def test_long_queries_match_any_substring(self):
+        index = PrepopIndex(['Kebab Hut', 'Burger Palace'])
+
+        self.assertEqual(index.search('bab'), ['Kebab Hut'])
+        self.assertEqual(index.search('burger pal'), ['Burger Palace'])
+
+class GetOrComputeTests(SimpleTestCase):
+    def test_waiters_do_not_sleep_behind_an_uncached_none(self):
+        cache = CacheBase('tests_', use_local = False)
+        key = f'none/?run={uuid.uuid4().hex}'
+        started = threading.Event()
+
+        def slow_none():
+            started.set()
+            time.sleep(0.3)
+            return None
+
+        holder = threading.Thread(target = lambda: cache.get_or_compute(key, slow_none))
+        holder.start()
+        started.wait()
+
+        began = time.monotonic()
+        self.assertEqual(cache.get_or_compute(key, lambda: None, wait = 5), None)
+        holder.join()
+
+        self.assertLess(time.monotonic() - began, 1)
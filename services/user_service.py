@@ -1,8 +1,17 @@
+from django.conf import settings
 from django.contrib.auth.models import User, Group
 
+from .cache.users_cache import UsersCache
+
+# stored with a user's group names, so that a user in no group is cached too
+NO_GROUP = ''
+
 class UserService():
     def __init__(self):
-        pass
+        self.cache = UsersCache()
+
+    def __groups_key__(self, user_id):
+        return f'groups/?user_id={user_id}'
 
     def create(self, **kwargs):
         user = User(**kwargs)
@@ -11,3 +20,19 @@ class UserService():
         user.save()
         return user
 
+    def in_group(self, user_id, name):
+        '''
+            Whether user @user_id is in group @name. The user's group names are kept in a Redis set,
+            dropped by clear_groups whenever their groups change
+        '''
+        key = self.__groups_key__(user_id)
+        names = self.cache.members(key)
+        if not names:
+            names = set(Group.objects.filter(user__id = user_id).values_list('name', flat = True))
+            names.add(NO_GROUP)
+            self.cache.set_add(key, names, settings.FIFTEEN_MINUTES)
+        return name in names
+
+    def clear_groups(self, *user_ids):
+        for user_id in user_ids:
+            self.cache.delete(self.__groups_key__(user_id))
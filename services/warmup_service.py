@@ -0,0 +1,126 @@
+import datetime, json, threading, time
+
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from django import db
+from django.conf import settings
+from django.db.models import Count, Q
+from django.utils import timezone
+from utils.app_logger import get_logger
+from domain.models import Restaurant
+from .restaurants import RestaurantsService
+from .menu_service import MenuService
+from .option_category_service import OptionCategoryService
+from .appuser_service import AppUserService
+
+logger = get_logger(__name__)
+
+def start_warmup():
+    '''
+        Warms the caches on a background thread when settings.CACHE_WARMUP_ON_START is set. Called by the
+        wsgi and asgi entrypoints only, so management commands, shells and tests never warm
+    '''
+    if settings.CACHE_WARMUP_ON_START:
+        threading.Thread(target = lambda: WarmupService().warm(settings.CACHE_WARMUP_TOP), name = 'cache-warmup', daemon = True).start()
+
+class WarmupService():
+    '''
+        Rebuilds the hot caches after a deploy or a redis flush: prepop, then the restaurant card, menu document,
+        options, option categories and price index of the busiest restaurants in parallel batches, and the
+        permission lookups of each batch's owners at once.
+    '''
+    def __init__(self, workers = 4, batch_size = 20):
+        self.workers = workers
+        self.batch_size = batch_size
+        self._restaurants = RestaurantsService()
+        self._menu = MenuService()
+        self._option_categories = OptionCategoryService()
+        self._appusers = AppUserService()
+
+    def top_restaurants(self, limit, days = 7):
+        '''
+            The active restaurants with the most orders over the last @days days
+        '''
+        since = timezone.now() - datetime.timedelta(days = days)
+        return list(Restaurant.objects \
+                        .filter(active = True) \
+                        .annotate(recent_orders = Count('orders', filter = Q(orders__created_on__gte = since))) \
+                        .order_by('-recent_orders', '-id') \
+                        .values('id', 'slug', 'appuser_id', 'appuser__user_id')[:limit])
+
+    def warm_restaurant(self, restaurant):
+        '''
+            Warms every cache a restaurant's customers and admin read, except the permission lookups
+            (see warm_permissions). Returns {step: seconds}
+        '''
+        timings = {}
+
+        def step(name, action):
+            started = time.perf_counter()
+            result = action()
+            timings[name] = time.perf_counter() - started
+            return result
+
+        try:
+            step('card', lambda: self._restaurants.get(restaurant['slug']))
+            menu = step('menu', lambda: self._menu.get_menu_document(restaurant['slug']))
+            item_slugs = [item['slug'] for category in json.loads(menu.body) for item in category['items']]
+            step('options', lambda: self._menu.get_options_many(restaurant['slug'], item_slugs))
+            step('option_categories', lambda: self._option_categories.get_by_restaurant(restaurant['id']))
+            step('price_index', lambda: self._menu.get_price_index(restaurant['id']))
+            return timings
+        finally:
+            db.connections.close_all()
+
+    def warm_permissions(self, restaurants):
+        '''
+            Warms the app user id and admin check lookups of a batch of restaurants' owners: one batched
+            app user id lookup and one batched admin check per owner. Returns the seconds spent
+        '''
+        started = time.perf_counter()
+        try:
+            self._appusers.get_appuser_ids_by_user_ids(set(restaurant['appuser__user_id'] for restaurant in restaurants))
+            owned = defaultdict(set)
+            for restaurant in restaurants:
+                owned[restaurant['appuser_id']].add(restaurant['id'])
+            for appuser_id, restaurant_ids in owned.items():
+                self._restaurants.check_admin_many(appuser_id, restaurant_ids)
+        except Exception:
+            logger.exception('Could not warm the permission lookups')
+        return time.perf_counter() - started
+
+    def warm(self, top = 100, days = 7, progress = None):
+        '''
+            Warms prepop and the @top busiest restaurants. @progress(done, total, restaurant, timings) is
+            called after every restaurant. Returns the total seconds spent per step
+        '''
+        started = time.perf_counter()
+        totals = {}
+
+        prepop_started = time.perf_counter()
+        self._restaurants.set_prepop()
+        totals['prepop'] = time.perf_counter() - prepop_started
+
+        restaurants = self.top_restaurants(top, days)
+        done = 0
+        with ThreadPoolExecutor(max_workers = self.workers, thread_name_prefix = 'cache-warmup') as executor:
+            for i in range(0, len(restaurants), self.batch_size):
+                batch = restaurants[i:i + self.batch_size]
+                totals['permissions'] = totals.get('permissions', 0) + self.warm_permissions(batch)
+                for restaurant, timings in zip(batch, executor.map(self.__safe_warm__, batch)):
+                    done += 1
+                    for name, seconds in timings.items():
+                        totals[name] = totals.get(name, 0) + seconds
+                    if progress:
+                        progress(done, len(restaurants), restaurant, timings)
+
+        totals['total'] = time.perf_counter() - started
+        logger.info(f'Warmed {done} restaurants in {totals["total"]:.2f}s')
+        return totals
+
+    def __safe_warm__(self, restaurant):
+        try:
+            return self.warm_restaurant(restaurant)
+        except Exception:
+            logger.exception(f'Could not warm the caches of restaurant {restaurant["id"]}')
+            return {}